@@ -1,7 +1,12 @@
 from .main import AC
 from .main import stop_criteria_dict
+from .session import ACSession
 from .stopping_criterias import BetaStoppingCriteria
 from .stopping_criterias import DirichletStoppingCriteria
 from .stopping_criterias import RandomStoppingCriteria
 from .stopping_criterias import MajorityStoppingCriteria
-from .stopping_criterias import EntropyStoppingCriteria
\ No newline at end of file
+from .stopping_criterias import EntropyStoppingCriteria
+from .policy import CompiledStoppingCriteria
+from .policy import compile_policy
+from .cache import LRUCache
+from .cache import CachedStoppingCriteria
@@ -0,0 +1,138 @@
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence
+
+import numpy as np
+
+from .stopping_criterias import StoppingCriterias
+
+
+class LRUCache:
+    '''
+    A thread-safe, bounded mapping with least-recently-used eviction and hit/miss counters.
+
+    Args:
+        maxsize (int): Maximum number of entries. None for unbounded.
+
+    Attributes:
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+    '''
+
+    _MISSING = object()
+
+    def __init__(self, maxsize : int = 65536) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key : Hashable, default : Any = None) -> Any:
+        with self._lock:
+            value = self._data.get(key, self._MISSING)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key : Hashable, value : Any) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if self.maxsize is not None and len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def __contains__(self, key : Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> Dict:
+        '''
+        Returns the hit/miss counters and current size.
+        '''
+        with self._lock:
+            return {'hits' : self.hits, 'misses' : self.misses, 'size' : len(self._data), 'maxsize' : self.maxsize}
+
+
+class CachedStoppingCriteria(StoppingCriterias):
+    '''
+    Wraps a stopping criteria with a memoizing decision cache.
+
+    The cache key is (criterion class, parameters, threshold, count signature), so a single LRUCache can be shared
+    across criteria, AC instances and threads. Criteria that are not deterministic (Random, unseeded Monte-Carlo
+    Dirichlet) are never cached: their decisions are passed through.
+
+    Args:
+        criterion (StoppingCriterias): The criterion to wrap.
+        cache (LRUCache): The cache to use. A new one with maxsize entries is created if None.
+        maxsize (int): Size of the new cache, if one is created.
+    '''
+
+    def __init__(self, criterion : StoppingCriterias, cache : LRUCache = None, maxsize : int = 65536) -> None:
+        super().__init__()
+        self.criterion = criterion
+        self.cache = cache if cache is not None else LRUCache(maxsize)
+        if not criterion.is_deterministic:
+            warnings.warn(f"{type(criterion).__name__} is not deterministic, so its decisions will not be cached.")
+        params = criterion.get_params()
+        params.pop('conf_thresh', None)
+        self._key_prefix = (type(criterion).__name__, tuple(sorted((k, repr(v)) for k, v in params.items())))
+
+    @property
+    def conf_thresh(self) -> float:
+        return getattr(self.criterion, 'conf_thresh', None)
+
+    @property
+    def state_width(self):
+        return self.criterion.state_width
+
+    @property
+    def is_deterministic(self) -> bool:
+        return self.criterion.is_deterministic
+
+    def get_params(self) -> Dict:
+        return {'criterion' : self.criterion, 'cache' : self.cache}
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return self.criterion.signature(counts)
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
+
+        if not self.criterion.is_deterministic:
+            return self.criterion.should_stop_counts(counts, conf_thresh, verbose)
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+
+        key = self._key_prefix + (conf_thresh, self.criterion.signature(counts))
+        return_dict = self.cache.get(key)
+        if return_dict is None:
+            return_dict = self.criterion.should_stop_counts(counts, conf_thresh, verbose)
+            self.cache.put(key, return_dict)
+        return dict(return_dict)
+
+    def min_additional_to_stop(self, counts : Sequence[int], max_additional : int = None, conf_thresh : float = None) -> Optional[int]:
+        return self.criterion.min_additional_to_stop(counts, max_additional, conf_thresh)
+
+    def is_futile(self, counts : Sequence[int], remaining : int, conf_thresh : float = None) -> bool:
+        return self.criterion.is_futile(counts, remaining, conf_thresh)
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+        return self.criterion.should_stop_counts_thresholds(counts, conf_threshs)
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+        if type(self.criterion).should_stop_counts_batch is StoppingCriterias.should_stop_counts_batch:
+            # No vectorized form, so evaluate row by row through the cache
+            return super().should_stop_counts_batch(sorted_counts, conf_thresh)
+        return self.criterion.should_stop_counts_batch(sorted_counts, conf_thresh)
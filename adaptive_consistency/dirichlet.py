@@ -0,0 +1,217 @@
+import numpy as np
+from typing import Sequence, Optional
+from collections import OrderedDict
+
+
+class DirichletMonteCarloEngine:
+    '''
+    Monte-Carlo estimate of the probability that the leading answer has the largest underlying probability,
+    under a Dirichlet(counts + 1) posterior (i.e. a uniform prior over the top answers).
+
+    Samples are drawn directly from the posterior through its Gamma representation: if X_i ~ Gamma(counts_i + 1)
+    independently, then X / sum(X) is Dirichlet distributed, and the normalization does not change the argmax.
+    Sample buffers are reused across calls, and results are cached by the sorted count tuple.
+
+    Args:
+        num_samples (int): Number of posterior samples per estimate.
+        seed (int): Seed for the random generator. When set, every count state gets its own generator derived
+            from (seed, counts), so estimates do not depend on the order of calls, and results are cached.
+        cache_size (int): Maximum number of cached results. Only used when seed is set.
+    '''
+
+    def __init__(self, num_samples : int = 50000, seed : Optional[int] = None, cache_size : int = 4096) -> None:
+        self.num_samples = num_samples
+        self.seed = seed
+        self.cache_size = cache_size
+        self._rng = np.random.default_rng(seed)
+        self._buffers = {}
+        self._cache = OrderedDict()
+
+    def _buffer(self, k : int) -> np.ndarray:
+        if k not in self._buffers:
+            self._buffers[k] = np.empty((self.num_samples, k))
+        return self._buffers[k]
+
+    def prob_leader_wins(self, counts : Sequence[int]) -> float:
+        '''
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order. The first one is the leader.
+
+        Returns:
+            float: Estimated probability that the leader's underlying probability is the largest.
+        '''
+        key = tuple(int(c) for c in counts)
+        if self.seed is not None and key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        rng = np.random.default_rng((self.seed, *key)) if self.seed is not None else self._rng
+        samples = self._buffer(len(key))
+        rng.standard_gamma(np.asarray(key, dtype = float) + 1, out = samples)
+        prob = float(np.count_nonzero(samples[:, 0] > samples[:, 1:].max(axis = 1)) / self.num_samples)
+
+        if self.seed is not None:
+            self._cache[key] = prob
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last = False)
+        return prob
+
+
+class DirichletQuadratureEngine:
+    '''
+    Exact (deterministic) probability that the leading answer has the largest underlying probability,
+    under a Dirichlet(counts + 1) posterior.
+
+    With X_i ~ Gamma(alpha_i) independently, the leader wins iff X_0 > X_i for all i > 0, so the probability is the
+    1-D integral of the Gamma(alpha_0) density times the product of the other Gamma CDFs. It is evaluated with
+    composite Gauss-Legendre quadrature over the bulk of the leader's density, so the cost barely depends on the
+    number of answers. Results are cached by the sorted count tuple.
+
+    Args:
+        num_panels (int): Number of sub-intervals of the integration range.
+        num_nodes (int): Number of Gauss-Legendre nodes per sub-interval.
+        width (float): Half-width of the integration range, in standard deviations of the leader's Gamma.
+        cache_size (int): Maximum number of cached results.
+    '''
+
+    def __init__(self, num_panels : int = 16, num_nodes : int = 16, width : float = 10., cache_size : int = 4096) -> None:
+        self.num_panels = num_panels
+        self.num_nodes = num_nodes
+        self.width = width
+        self.cache_size = cache_size
+        self._nodes, self._weights = np.polynomial.legendre.leggauss(num_nodes)
+        self._cache = OrderedDict()
+
+    def prob_leader_wins(self, counts : Sequence[int]) -> float:
+        '''
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order. The first one is the leader.
+
+        Returns:
+            float: Probability that the leader's underlying probability is the largest.
+        '''
+        key = tuple(int(c) for c in counts)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        from scipy import special
+
+        leader = key[0] + 1.
+        lo = max(0., leader - self.width * np.sqrt(leader))
+        hi = leader + self.width * (np.sqrt(leader) + 1)
+        edges = np.linspace(lo, hi, self.num_panels + 1)
+        half, mid = (edges[1:] - edges[:-1]) / 2, (edges[1:] + edges[:-1]) / 2
+        x = (mid[:, None] + half[:, None] * self._nodes).ravel()
+        w = (half[:, None] * self._weights).ravel()
+
+        # Equal counts contribute the same CDF, so evaluate each distinct one once
+        others, multiplicity = np.unique(np.asarray(key[1:], dtype = float) + 1, return_counts = True)
+        with np.errstate(divide = 'ignore'):
+            log_integrand = (leader - 1) * np.log(x) - x - special.gammaln(leader)
+            log_integrand = log_integrand + multiplicity @ np.log(special.gammainc(others[:, None], x))
+        prob = float(min(1., w @ np.exp(log_integrand)))
+
+        self._cache[key] = prob
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last = False)
+        return prob
+
+
+class DirichletQMCEngine:
+    '''
+    Randomized quasi-Monte-Carlo estimate of the probability that the leading answer has the largest underlying
+    probability, under a Dirichlet(counts + 1) posterior, that stops sampling as soon as the decision is clear.
+
+    As in the exact engine, the leader wins with probability E[prod_i F_i(X_0)], where X_0 ~ Gamma(alpha_0) and F_i is
+    the Gamma(alpha_i) CDF of each other answer. The expectation is estimated over independently scrambled Sobol points
+    (one sequence per replicate), in blocks that double in size. After each block, the spread of the replicate
+    estimates gives a confidence interval, and sampling stops once the interval lies entirely above or below conf_thresh,
+    or the budget of num_samples points is spent. Results are cached by the count tuple and threshold.
+
+    Args:
+        num_samples (int): Maximum number of points per estimate, across all replicates. Each replicate gets the largest
+            power of two that fits, but at least one initial block.
+        seed (int): Seed for the scrambling. When set, estimates are deterministic, and results are cached.
+        num_replicates (int): Number of independently scrambled sequences, used for the error estimate.
+        initial_block (int): Number of points per replicate in the first block. Rounded up to a power of two.
+        confidence (float): Coverage of the confidence interval used to stop early.
+        cache_size (int): Maximum number of cached results. Only used when seed is set.
+    '''
+
+    def __init__(self, num_samples : int = 50000, seed : Optional[int] = None, num_replicates : int = 8, initial_block : int = 32, confidence : float = 0.99, cache_size : int = 4096) -> None:
+        self.num_samples = num_samples
+        self.seed = seed
+        self.num_replicates = num_replicates
+        self.initial_block = 1 << max(0, int(np.ceil(np.log2(initial_block))))
+        self.confidence = confidence
+        self.cache_size = cache_size
+        self._points = None
+        self._cache = OrderedDict()
+
+    def _sobol_points(self) -> np.ndarray:
+        # One scrambled 1-D Sobol sequence per replicate, generated once and shared by all count states
+        if self._points is None:
+            from scipy.stats import qmc
+
+            # Rounded down, so that num_samples is a true maximum
+            per_replicate = max(self.initial_block, 1 << int(np.floor(np.log2(max(1, self.num_samples // self.num_replicates)))))
+            seeds = np.random.SeedSequence(self.seed).spawn(self.num_replicates)
+            self._points = np.stack([qmc.Sobol(1, scramble = True, seed = np.random.default_rng(s)).random(per_replicate)[:, 0] for s in seeds])
+        return self._points
+
+    def estimate(self, counts : Sequence[int], conf_thresh : Optional[float] = None) -> tuple:
+        '''
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order. The first one is the leader.
+            conf_thresh (float): Stop sampling once the confidence interval excludes this value. Uses the whole budget if None.
+
+        Returns:
+            Tuple[float, float, int]: The estimated probability, the half-width of its confidence interval, and the number of points used.
+        '''
+        from scipy import special
+
+        key = (tuple(int(c) for c in counts), conf_thresh)
+        if self.seed is not None and key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        alpha = np.asarray(key[0], dtype = float) + 1
+        points = self._sobol_points()
+        t_quantile = special.stdtrit(self.num_replicates - 1, (1 + self.confidence) / 2)
+
+        sums = np.zeros(self.num_replicates)
+        n, block = 0, self.initial_block
+        while True:
+            u = points[:, n:n + block]
+            x = special.gammaincinv(alpha[0], u)
+            with np.errstate(divide = 'ignore'):
+                log_f = np.log(special.gammainc(alpha[1:, None, None], x)).sum(axis = 0)
+            sums += np.exp(log_f).sum(axis = 1)
+            n += u.shape[1]
+
+            estimates = sums / n
+            prob = float(min(1., estimates.mean()))
+            half_width = float(t_quantile * estimates.std(ddof = 1) / np.sqrt(self.num_replicates))
+            if n >= points.shape[1] or (conf_thresh is not None and abs(prob - conf_thresh) > half_width):
+                break
+            # Doubling keeps the number of points per replicate a power of two, where Sobol points are balanced
+            block = n
+
+        result = (prob, half_width, n * self.num_replicates)
+        if self.seed is not None:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last = False)
+        return result
+
+    def prob_leader_wins(self, counts : Sequence[int], conf_thresh : Optional[float] = None) -> float:
+        '''
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order. The first one is the leader.
+            conf_thresh (float): Stop sampling once the decision against this threshold is clear.
+
+        Returns:
+            float: Estimated probability that the leader's underlying probability is the largest.
+        '''
+        return self.estimate(counts, conf_thresh)[0]
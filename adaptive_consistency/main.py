@@ -1,9 +1,13 @@
 import numpy as np
 
-from typing import List, Any
+from typing import List, Any, Callable, Dict, Optional, Union
+from collections import Counter
 import warnings
 
 from .stopping_criterias import *
+from .session import ACSession
+from .policy import CompiledStoppingCriteria
+from .cache import LRUCache, CachedStoppingCriteria
 
 class AC:
     '''
@@ -13,6 +17,9 @@ class AC:
         max_gens (int): Maximum number of generations to perform for each question.
         stop_criteria : StoppingCriterias: The stopping criteria function to use. 
         verbose (bool): Whether to print verbose output.
+        cache (Union[bool, LRUCache]): Whether to memoize stopping decisions by count state. Pass an LRUCache to share it across AC instances.
+        futility (bool): Whether to also stop once the remaining budget can no longer make the stopping criteria fire.
+            Such results are flagged with 'exhausted' in the output dictionary.
 
     Attributes:
         max_gens (int): Maximum number of generations to perform.
@@ -20,7 +27,7 @@ class AC:
         stop_criteria: The stopping criteria function to use.
     '''
 
-    def __init__(self, max_gens : int = 40, stop_criteria = BetaStoppingCriteria, verbose : bool = False) -> None:
+    def __init__(self, max_gens : int = 40, stop_criteria = BetaStoppingCriteria, verbose : bool = False, cache : Union[bool, LRUCache] = False, futility : bool = False) -> None:
         '''
         Initializes an instance of the AC class.
 
@@ -28,10 +35,16 @@ class AC:
             max_gens (int): Maximum number of generations to perform.
             stop_criteria (StoppingCriterias): The stopping criteria function to use. 
             verbose (bool): Whether to print verbose output.
+            cache (Union[bool, LRUCache]): Whether to memoize stopping decisions by count state. Pass an LRUCache to share it across AC instances.
+            futility (bool): Whether to also stop once the remaining budget can no longer make the stopping criteria fire.
         '''
 
         self.max_gens = max_gens
         self.verbose = verbose
+        self.futility = futility
+        if cache is True:
+            cache = LRUCache()
+        self.cache = cache if isinstance(cache, LRUCache) else None
         self.set_stop_criteria(stop_criteria)
 
 
@@ -49,7 +62,8 @@ class AC:
         Sets the stopping criteria function.
 
         Args:
-            stop_criteria (StoppingCriterias): The stopping criteria function to use. 
+            stop_criteria (StoppingCriterias): The stopping criteria function to use. Can also be the name of a criteria,
+                or the path to a `.npz` policy table produced by `compile_policy`.
         '''
         if isinstance(stop_criteria, str):
             if stop_criteria == 'beta':
@@ -62,6 +76,9 @@ class AC:
                 self.stop_criteria = MajorityStoppingCriteria()
             elif stop_criteria == 'entropy':
                 self.stop_criteria = EntropyStoppingCriteria()
+            elif stop_criteria.endswith('.npz'):
+                # Precompiled policy table, see `compile_policy`
+                self.stop_criteria = CompiledStoppingCriteria.load(stop_criteria)
             else:
                 raise ValueError(f"Unknown stopping criteria: {stop_criteria}")
 
@@ -72,13 +89,17 @@ class AC:
             # The function is not initialized, so we need to initialize it
             self.stop_criteria = stop_criteria()
 
-    def should_stop(self, answers : List[Any], return_dict : bool = False) -> bool:
+        if self.cache is not None and not isinstance(self.stop_criteria, CachedStoppingCriteria):
+            self.stop_criteria = CachedStoppingCriteria(self.stop_criteria, self.cache)
+
+    def should_stop(self, answers : List[Any], return_dict : bool = False, remaining : Optional[int] = None) -> bool:
         '''
         Checks if the answers are consistent based on Adaptive Consistency Algorithm and corresponding Stopping Criteria.
 
         Args:
             answers (List): A list of answers to check consistency.
             return_dict (bool): Whether to return the full dictionary of output.
+            remaining (int): Number of answers that can still be sampled, used by the futility check. Defaults to max_gens - len(answers).
 
         Returns:
             Union[bool, Dict]: Whether the answers are consistent or not. If return_dict is True, returns the full dictionary of output.
@@ -91,11 +112,81 @@ class AC:
 
 
         should_stop = self.stop_criteria.should_stop(answers, verbose=self.verbose)
+        if remaining is None:
+            remaining = self.max_gens - len(answers)
+        self.check_futility(should_stop, lambda: sorted(Counter(answers).values(), reverse = True), remaining)
+        if return_dict:
+            return should_stop
+        else:
+            return should_stop['stop']
+
+    def check_futility(self, should_stop : Dict, get_counts : Callable[[], List[int]], remaining : int) -> Dict:
+        '''
+        Adds the 'exhausted' flag to a stopping decision, and if futility checks are enabled, stops when the remaining
+        budget can no longer make the stopping criteria fire.
+
+        Args:
+            should_stop (Dict): Output of the stopping criteria, updated in place.
+            get_counts (Callable): Returns the sorted answer counts. Only called when needed.
+            remaining (int): Number of answers that can still be sampled.
+
+        Returns:
+            Dict: The updated should_stop.
+        '''
+        should_stop['exhausted'] = False
+        if self.futility and not should_stop['stop'] and self.stop_criteria.is_futile(get_counts(), remaining):
+            should_stop['stop'] = True
+            should_stop['exhausted'] = True
+        return should_stop
+
+    def min_additional_to_stop(self, answers : List[Any]) -> Optional[int]:
+        '''
+        Smallest number of additional answers agreeing with the current majority after which the stopping criteria fires,
+        within the remaining budget of max_gens answers. Useful for sizing the next sampling request (e.g. `n=` in API calls).
+
+        Args:
+            answers (List): A list of answers so far. May be empty.
+
+        Returns:
+            Optional[int]: The number of additional answers, or None if the criteria cannot fire within the budget.
+        '''
+        counts = sorted(Counter(answers).values(), reverse = True)
+        return self.stop_criteria.min_additional_to_stop(counts, max(0, self.max_gens - len(answers)))
+
+    def should_stop_batch(self, counts : np.ndarray, return_dict : bool = False) -> np.ndarray:
+        '''
+        Checks many questions at once, given a batch of count states.
+
+        Args:
+            counts (np.ndarray): 2-D array with one row of answer counts per question (e.g. top-k counts), zero-padded.
+            return_dict (bool): Whether to return the full dictionary of output.
+
+        Returns:
+            Union[np.ndarray, Dict]: Boolean stop flag per question. If return_dict is True, returns a dictionary of arrays
+            'most_common' (column index of the majority answer), 'prob' and 'stop'.
+        '''
+        should_stop = self.stop_criteria.should_stop_batch(counts)
         if return_dict:
             return should_stop
         else:
             return should_stop['stop']
 
+    def session(self) -> ACSession:
+        '''
+        Creates an incremental session, which is fed one answer (or a batch) at a time and keeps a running count state.
+
+        Example:
+            session = ac.session()
+            for _ in range(ac.max_gens):
+                session.add(generate_answer_from_model())
+                if session.should_stop():
+                    break
+
+        Returns:
+            ACSession: A new session bound to this AC instance.
+        '''
+        return ACSession(self)
+
     def eval_loop(self, eval_function, *args, **kwargs):
         '''
         Runs AdaptiveConsistency Algorithm by repeatedly calling the evaluation function until the stopping criteria is met.
@@ -109,11 +200,60 @@ class AC:
             List: A list of answers generated from evaluation function using AdaptiveConsistency.
         '''
         answers = []
+        session = self.session()
         for _ in range(self.max_gens):
             answer = eval_function(*args, **kwargs)
             answers.append(answer)
-            if self.is_consistent(answers):
-                return answers
+            session.add(answer)
+            if session.should_stop():
+                break
+        return answers
+
+    async def eval_loop_async(self, async_sample_fn, *args, concurrency : int = 4, **kwargs):
+        '''
+        Runs AdaptiveConsistency Algorithm with up to `concurrency` samples in flight.
+
+        Each answer is fed to the stopping criteria as soon as it arrives, and the outstanding samples are cancelled
+        once the criteria fires. At most max_gens samples are started.
+
+        Args:
+            async_sample_fn: Coroutine function returning one answer.
+            *args: Additional positional arguments to pass to the async_sample_fn.
+            concurrency (int): Maximum number of samples in flight.
+            **kwargs: Additional keyword arguments to pass to the async_sample_fn.
+
+        Returns:
+            List: The answers, in order of arrival.
+        '''
+        import asyncio
+
+        answers = []
+        session = self.session()
+        pending, done = set(), set()
+        num_started = 0
+        try:
+            while True:
+                while len(pending) < concurrency and num_started < self.max_gens:
+                    pending.add(asyncio.ensure_future(async_sample_fn(*args, **kwargs)))
+                    num_started += 1
+                if not pending:
+                    return answers
+                done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    answer = task.result()
+                    answers.append(answer)
+                    session.add(answer)
+                    if session.should_stop():
+                        return answers
+        finally:
+            for task in done:
+                # Mark results that were not consumed (e.g. after an early stop or error) as retrieved
+                if not task.cancelled():
+                    task.exception()
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions = True)
             
 
 stop_criteria_dict = {
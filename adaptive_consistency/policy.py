@@ -0,0 +1,132 @@
+import json
+import numpy as np
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from . import stopping_criterias
+from .stopping_criterias import StoppingCriterias
+
+
+def iter_count_states(max_gens : int, width : Optional[int] = None) -> Iterator[Tuple[int, ...]]:
+    '''
+    Enumerates sorted count vectors with at most max_gens answers in total, covering every reachable combination of
+    the leading `width` counts and the total number of answers. With width None, enumerates every count vector.
+    '''
+    def prefixes(remaining, max_part, length):
+        for part in range(min(remaining, max_part), 0, -1):
+            yield (part,)
+            if width is None or length + 1 < width:
+                for rest in prefixes(remaining - part, part, length + 1):
+                    yield (part,) + rest
+
+    for prefix in prefixes(max_gens, max_gens, 0):
+        yield prefix
+        if width is not None and len(prefix) == width:
+            # The remaining answers can be any split into parts no larger than the last leading count.
+            # All such splits share the same signature for criteria that only look at the leading counts and the total.
+            last = prefix[-1]
+            for extra in range(1, max_gens - sum(prefix) + 1):
+                yield prefix + (last,) * (extra // last) + ((extra % last,) if extra % last else ())
+
+
+class CompiledStoppingCriteria(StoppingCriterias):
+    '''
+    A stopping criteria whose decisions were precompiled for every reachable count state, answering with a table lookup.
+
+    Build one with `compile_policy`, save it with `save` and load it at startup with `CompiledStoppingCriteria.load`
+    (or by passing the `.npz` path to `AC(stop_criteria=...)`). Count states beyond the compiled max_gens, or calls with
+    a different conf_thresh, are delegated to the original criterion.
+
+    Args:
+        criterion (StoppingCriterias): The criterion the table was compiled from.
+        max_gens (int): Maximum total number of answers covered by the table.
+        signatures (np.ndarray): 2-D array of count state signatures, padded with -1.
+        prob (np.ndarray): Probability for each signature.
+        stop (np.ndarray): Stop decision for each signature.
+    '''
+
+    def __init__(self, criterion : StoppingCriterias, max_gens : int, signatures : np.ndarray, prob : np.ndarray, stop : np.ndarray) -> None:
+        super().__init__()
+        self.criterion = criterion
+        self.max_gens = max_gens
+        self.conf_thresh = getattr(criterion, 'conf_thresh', None)
+        self.signatures = signatures
+        self.prob = prob
+        self.stop = stop
+        self._index = {tuple(int(c) for c in row if c >= 0) : i for i, row in enumerate(signatures)}
+
+    @property
+    def state_width(self):
+        return self.criterion.state_width
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return self.criterion.signature(counts)
+
+    def get_params(self) -> Dict:
+        return {'criterion' : self.criterion, 'max_gens' : self.max_gens}
+
+    def is_futile(self, counts : Sequence[int], remaining : int, conf_thresh : float = None) -> bool:
+        return self.criterion.is_futile(counts, remaining, conf_thresh)
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
+
+        idx = self._index.get(self.criterion.signature(counts))
+        if idx is None or (conf_thresh is not None and conf_thresh != self.conf_thresh):
+            return self.criterion.should_stop_counts(counts, conf_thresh, verbose)
+        return {
+            'prob' : float(self.prob[idx]),
+            'stop' : bool(self.stop[idx]),
+        }
+
+    def save(self, path : str) -> None:
+        '''
+        Saves the table to a `.npz` file.
+        '''
+        np.savez_compressed(
+            path,
+            signatures = self.signatures,
+            prob = self.prob,
+            stop = self.stop,
+            max_gens = self.max_gens,
+            criterion = type(self.criterion).__name__,
+            params = json.dumps(self.criterion.get_params()),
+        )
+
+    @classmethod
+    def load(cls, path : str) -> 'CompiledStoppingCriteria':
+        '''
+        Loads a table saved with `save`.
+        '''
+        with np.load(path) as data:
+            criterion = getattr(stopping_criterias, str(data['criterion']))(**json.loads(str(data['params'])))
+            return cls(criterion, int(data['max_gens']), data['signatures'], data['prob'], data['stop'])
+
+
+def compile_policy(criterion : StoppingCriterias, max_gens : int = 40) -> CompiledStoppingCriteria:
+    '''
+    Evaluates a stopping criteria on every count state reachable within max_gens answers.
+
+    Args:
+        criterion (StoppingCriterias): The criterion to compile. Must be deterministic (e.g. a seeded or exact Dirichlet).
+        max_gens (int): Maximum total number of answers per question.
+
+    Returns:
+        CompiledStoppingCriteria: The compiled criterion.
+    '''
+    if not criterion.is_deterministic:
+        raise ValueError(f"Cannot compile {type(criterion).__name__}, since its decisions are not deterministic.")
+
+    states = {}
+    for counts in iter_count_states(max_gens, criterion.state_width):
+        states.setdefault(criterion.signature(counts), counts)
+
+    width = max(len(counts) for counts in states.values())
+    sorted_counts = np.zeros((len(states), width), dtype = np.int64)
+    for i, counts in enumerate(states.values()):
+        sorted_counts[i, :len(counts)] = counts
+    outp = criterion.should_stop_counts_batch(sorted_counts)
+
+    signature_width = max(len(sig) for sig in states)
+    signatures = np.full((len(states), signature_width), -1, dtype = np.int32)
+    for i, sig in enumerate(states):
+        signatures[i, :len(sig)] = sig
+    return CompiledStoppingCriteria(criterion, max_gens, signatures, np.asarray(outp['prob'], dtype = float), np.asarray(outp['stop'], dtype = bool))
@@ -0,0 +1,145 @@
+from typing import Any, Iterable, Optional
+import warnings
+
+
+class ACSession:
+    '''
+    Incremental Adaptive Consistency state for a single question.
+
+    Answers are fed one at a time (or in batches) and interned to integer ids. The session keeps the
+    per-answer counts as a vector sorted in non-increasing order, updated in O(1) per answer, and hands
+    that vector directly to the stopping criteria instead of recounting the full answer list.
+
+    Args:
+        ac (AC): The AC instance whose stopping criteria and max_gens to use.
+
+    Attributes:
+        answers (List): The distinct answers seen so far, indexed by answer id (first-seen order).
+        answer_ids (Dict): Mapping from answer to answer id.
+        sorted_counts (List[int]): Answer counts in non-increasing order.
+        num_answers (int): Total number of answers fed so far.
+    '''
+
+    def __init__(self, ac) -> None:
+        self.ac = ac
+        self.reset()
+
+    def reset(self) -> None:
+        '''
+        Clears all answers, so that the session can be reused for a new question.
+        '''
+        self.answers = []
+        self.answer_ids = {}
+        self.sorted_counts = []
+        self.num_answers = 0
+
+        # _order[p] is the answer id at position p of sorted_counts, and _position is its inverse.
+        # _block_start[c] is the first position holding count c, which is where an answer with count c
+        # is swapped to before being incremented, keeping sorted_counts ordered.
+        self._order = []
+        self._position = []
+        self._block_start = {}
+
+        # Leader is tracked separately so that ties are broken by first occurrence, as in Counter.most_common
+        self._leader = None
+        self._leader_count = 0
+
+    def add(self, answer : Any) -> int:
+        '''
+        Adds a single answer to the session.
+
+        Args:
+            answer: The answer to add. Must be hashable.
+
+        Returns:
+            int: The id of the answer.
+        '''
+        answer_id = self.answer_ids.get(answer)
+        if answer_id is None:
+            answer_id = len(self.answers)
+            self.answer_ids[answer] = answer_id
+            self.answers.append(answer)
+            self._order.append(answer_id)
+            self._position.append(len(self.sorted_counts))
+            self.sorted_counts.append(0)
+            self._block_start.setdefault(0, len(self.sorted_counts) - 1)
+
+        pos = self._position[answer_id]
+        count = self.sorted_counts[pos]
+        start = self._block_start[count]
+
+        # Swap the answer to the front of its block, then increment it in place
+        other_id = self._order[start]
+        self._order[start], self._order[pos] = answer_id, other_id
+        self._position[answer_id], self._position[other_id] = start, pos
+        self.sorted_counts[start] = count + 1
+
+        if start + 1 < len(self.sorted_counts) and self.sorted_counts[start + 1] == count:
+            self._block_start[count] = start + 1
+        else:
+            del self._block_start[count]
+        self._block_start.setdefault(count + 1, start)
+
+        if count + 1 > self._leader_count or (count + 1 == self._leader_count and answer_id < self._leader):
+            self._leader, self._leader_count = answer_id, count + 1
+
+        self.num_answers += 1
+        if self.num_answers > self.ac.max_gens and self.ac.verbose:
+            warnings.warn(f"Warning: max_gens ({self.ac.max_gens}) reached.")
+        return answer_id
+
+    def extend(self, answers : Iterable[Any]) -> None:
+        '''
+        Adds a batch of answers to the session.
+
+        Args:
+            answers (Iterable): The answers to add.
+        '''
+        for answer in answers:
+            self.add(answer)
+
+    @property
+    def most_common(self) -> Any:
+        '''
+        The current majority answer. Ties are broken in favour of the answer seen first.
+        '''
+        if self._leader is None:
+            return None
+        return self.answers[self._leader]
+
+    def __len__(self) -> int:
+        return self.num_answers
+
+    def should_stop(self, return_dict : bool = False, remaining : Optional[int] = None) -> bool:
+        '''
+        Checks if the answers fed so far are consistent, based on the AC instance's stopping criteria.
+
+        Args:
+            return_dict (bool): Whether to return the full dictionary of output.
+            remaining (int): Number of answers that can still be sampled, used by the futility check. Defaults to max_gens minus the answers so far.
+
+        Returns:
+            Union[bool, Dict]: Whether to stop sampling. If return_dict is True, returns the full dictionary of output.
+        '''
+        if self.num_answers == 0:
+            raise ValueError("Cannot check consistency of an empty session.")
+
+        should_stop = {'most_common' : self.most_common}
+        should_stop.update(self.ac.stop_criteria.should_stop_counts(self.sorted_counts, verbose = self.ac.verbose))
+        if remaining is None:
+            remaining = self.ac.max_gens - self.num_answers
+        self.ac.check_futility(should_stop, lambda: self.sorted_counts, remaining)
+        if return_dict:
+            return should_stop
+        else:
+            return should_stop['stop']
+
+    def min_additional_to_stop(self) -> Optional[int]:
+        '''
+        Smallest number of additional answers agreeing with the current majority after which the stopping criteria fires,
+        within the remaining budget of max_gens answers. Useful for sizing the next sampling request.
+
+        Returns:
+            Optional[int]: The number of additional answers, or None if the criteria cannot fire within the budget.
+        '''
+        return self.ac.stop_criteria.min_additional_to_stop(self.sorted_counts, max(0, self.ac.max_gens - self.num_answers))
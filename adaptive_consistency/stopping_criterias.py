@@ -1,18 +1,197 @@
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence
 from collections import Counter
-from scipy import integrate, stats
+
+# SciPy is imported inside the functions that use it, so that importing the package (and using criteria that do not
+# need it, e.g. Majority) does not pay for it. Its import dominates the package's import time.
+
+from .dirichlet import DirichletMonteCarloEngine, DirichletQMCEngine, DirichletQuadratureEngine
+
+
+def beta_log_tail(a, b):
+    '''
+    Log-probability that the leading answer is *not* the majority, i.e. log P(p <= 0.5) for p ~ Beta(a + 1, b + 1).
+
+    Uses the regularized incomplete beta function, and switches to the equivalent binomial tail summed in
+    log-space wherever the former underflows (very large, very lopsided counts).
+    Accepts scalars or arrays.
+    '''
+    from scipy import special
+
+    a, b = np.broadcast_arrays(np.asarray(a, dtype = float), np.asarray(b, dtype = float))
+    tail = special.betainc(a + 1, b + 1, 0.5)
+    with np.errstate(divide = 'ignore'):
+        log_tail = np.log(tail)
+    underflow = np.atleast_1d(tail == 0)
+    if underflow.any():
+        log_tail = np.atleast_1d(log_tail)
+        flat_a, flat_b = np.atleast_1d(a), np.atleast_1d(b)
+        for idx in zip(*np.nonzero(underflow)):
+            # I_{1/2}(a + 1, b + 1) = P(Binomial(a + b + 1, 1/2) > a) for integer counts
+            n = np.floor(flat_a[idx]) + np.floor(flat_b[idx]) + 1
+            j = np.arange(np.floor(flat_a[idx]) + 1, n + 1)
+            log_tail[idx] = special.logsumexp(special.gammaln(n + 1) - special.gammaln(j + 1) - special.gammaln(n - j + 1)) - n * np.log(2)
+        log_tail = log_tail.reshape(a.shape)
+    return log_tail
+
+
+def beta_stop_prob(a, b):
+    '''
+    Probability that the leading answer (count a) is the majority over the runner-up (count b), under a uniform prior.
+    Equivalent to integrating x^a (1-x)^b over [0.5, 1] and normalizing.
+    '''
+    return -np.expm1(beta_log_tail(a, b))
 
 
 class StoppingCriterias:
 
+    # Number of leading counts the decision depends on (None for all of them). See `signature`.
+    state_width = None
+
     def __init__(self, *args, **kwargs):
 
         ...
 
-    def should_stop(self, *args, **kwargs) -> Dict:
+    @property
+    def is_deterministic(self) -> bool:
+        '''
+        Whether the decision is a fixed function of the count vector, so that it can be precompiled or cached.
+        '''
+        return True
+
+    def get_params(self) -> Dict:
+        '''
+        The constructor parameters of the criterion, such that `type(self)(**self.get_params())` recreates it.
+        '''
+        return {k : v for k, v in vars(self).items() if not k.startswith('_')}
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        '''
+        A compact key for the sorted count vector, such that equal signatures always yield the same decision.
+        '''
+        return tuple(int(c) for c in counts)
+
+    def should_stop(self, answers : List, conf_thresh : float = None, verbose : bool = False) -> Dict:
+        '''
+        Decides whether to stop sampling given the full list of answers so far.
+        Counts the answers once and defers to `should_stop_counts`.
+        '''
+        counter = Counter(answers)
+        return_dict = {'most_common' : counter.most_common(1)[0][0]}
+        return_dict.update(self.should_stop_counts(sorted(counter.values(), reverse = True), conf_thresh, verbose))
+        return return_dict
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
+        '''
+        Decides whether to stop sampling given the answer counts, sorted in non-increasing order.
+        Returns a dictionary with keys 'prob' and 'stop'.
+        '''
         ...
 
+    def min_additional_to_stop(self, counts : Sequence[int], max_additional : int = None, conf_thresh : float = None) -> Optional[int]:
+        '''
+        Smallest number of additional answers agreeing with the current leader after which the criteria stops.
+
+        Assumes the decision is monotone in the leader's count, and finds it by exponential and binary search.
+
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order. May be empty.
+            max_additional (int): Only look this far ahead, e.g. the remaining sampling budget. Unbounded if None.
+            conf_thresh (float): Overrides the criterion's confidence threshold.
+
+        Returns:
+            Optional[int]: The number of additional answers (0 if the criteria already stops), or None if it cannot stop within max_additional.
+        '''
+        counts = list(counts) if len(counts) else [0]
+        limit = max_additional if max_additional is not None else 1 << 20
+
+        def stops(m):
+            if counts[0] + m == 0:
+                return False
+            return bool(self.should_stop_counts([counts[0] + m] + counts[1:], conf_thresh)['stop'])
+
+        if stops(0):
+            return 0
+        lo, hi = 0, 1
+        while not stops(min(hi, limit)):
+            if hi >= limit:
+                return None
+            lo, hi = hi, 2 * hi
+        hi = min(hi, limit)
+        # Invariant: stops(hi) and not stops(lo)
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if stops(mid):
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+    def is_futile(self, counts : Sequence[int], remaining : int, conf_thresh : float = None) -> bool:
+        '''
+        Whether no sequence of the remaining answers can make the criteria stop.
+
+        Assumes the most favourable sequence gives every remaining answer to the current leader, so that this holds iff
+        `min_additional_to_stop` finds no solution within the remaining budget. That holds for criteria that only get more
+        confident as the leader pulls ahead (Beta, Majority, Dirichlet). Criteria that other answers can also help, like
+        Entropy, override this.
+
+        Args:
+            counts (Sequence[int]): Answer counts, sorted in non-increasing order.
+            remaining (int): Number of answers that can still be sampled.
+            conf_thresh (float): Overrides the criterion's confidence threshold.
+        '''
+        return self.min_additional_to_stop(counts, max(0, remaining), conf_thresh) is None
+
+    def should_stop_batch(self, counts : np.ndarray, conf_thresh : float = None) -> Dict:
+        '''
+        Decides whether to stop sampling for many questions at once.
+
+        Args:
+            counts (np.ndarray): 2-D array with one row of answer counts per question, zero-padded. Columns need not be sorted.
+            conf_thresh (float): Overrides the criterion's confidence threshold.
+
+        Returns:
+            Dict: Arrays 'most_common' (column index of the majority answer, first column on ties, -1 for empty rows), 'prob' and 'stop'.
+        '''
+        counts = np.asarray(counts)
+        if counts.ndim != 2:
+            raise ValueError(f"Expected a 2-D array of counts, got shape {counts.shape}")
+        empty = counts.sum(axis = 1) == 0
+
+        return_dict = {'most_common' : np.where(empty, -1, np.argmax(counts, axis = 1))}
+        return_dict.update(self.should_stop_counts_batch(-np.sort(-counts, axis = 1), conf_thresh))
+        return_dict['prob'] = np.where(empty, -1, return_dict['prob'])
+        return_dict['stop'] = return_dict['stop'] & ~empty
+        return return_dict
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+        '''
+        Batched version of `should_stop_counts`. Each row of sorted_counts is non-increasing and zero-padded.
+        Returns a dictionary with arrays 'prob' and 'stop'. Criteria without a vectorized form evaluate row by row.
+        '''
+        prob = np.full(len(sorted_counts), -1.)
+        stop = np.zeros(len(sorted_counts), dtype = bool)
+        for i, row in enumerate(sorted_counts):
+            row = row[row > 0]
+            if len(row) == 0:
+                continue
+            outp = self.should_stop_counts(row.tolist(), conf_thresh)
+            prob[i], stop[i] = outp['prob'], outp['stop']
+        return {'prob' : prob, 'stop' : stop}
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+        '''
+        Decides whether to stop for several confidence thresholds at once, e.g. to sweep thresholds offline.
+        Returns a dictionary with the 'prob' of the count state and a boolean array 'stop', one entry per threshold.
+        Criteria whose decision is a comparison of 'prob' against the threshold compute the probability only once.
+        '''
+        outps = [self.should_stop_counts(counts, conf_thresh) for conf_thresh in conf_threshs]
+        return {
+            'prob' : outps[0]['prob'] if outps else -1,
+            'stop' : np.array([outp['stop'] for outp in outps], dtype = bool),
+        }
+
 
 class BetaStoppingCriteria(StoppingCriterias):
 
@@ -20,54 +199,111 @@ class BetaStoppingCriteria(StoppingCriterias):
         super().__init__()
         self.conf_thresh = conf_thresh
 
-    def should_stop(self, answers : List, conf_thresh : int = None, verbose : bool = False) -> Dict:
+    state_width = 2
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return (int(counts[0]), int(counts[1]) if len(counts) > 1 else 0)
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
         
         if conf_thresh is None: conf_thresh = self.conf_thresh
 
-        
-        most_common = Counter(answers).most_common(2)
-        if len(most_common) == 1:
-            a, b = most_common[0][1], 0
-        else:
-            a, b= most_common[0][1], most_common[1][1]
-        a = float(a)
-        b = float(b)
+        a = float(counts[0])
+        b = float(counts[1]) if len(counts) > 1 else 0.
 
         return_dict = {
-            'most_common' : most_common[0][0],
             'prob' : -1,
             'stop' : False,
         }
-            
 
-        try:
-            prob =  integrate.quad(lambda x : x**(a) * (1-x)**(b), 0.5, 1)[0] / integrate.quad(lambda x : x**(a) * (1-x)**(b), 0, 1)[0]
-        except Exception as e:
-            # print error message
-            print(f"Error during numerical integration: {e}")
-            return_dict['stop'] = False
-            return_dict['prob'] = -1
+        log_tail = float(beta_log_tail(a, b))
+        if np.isnan(log_tail):
+            print(f"Error during beta evaluation: a={a}, b={b}")
             return return_dict
-        return_dict['prob'] = prob
-        return_dict['stop'] = prob >= conf_thresh
+        return_dict['prob'] = float(-np.expm1(log_tail))
+        if conf_thresh < 1:
+            # Compare in log-space so that thresholds very close to 1 are still resolved exactly
+            return_dict['stop'] = bool(log_tail <= np.log1p(-conf_thresh))
+        else:
+            return_dict['stop'] = return_dict['prob'] >= conf_thresh
         return return_dict
 
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+
+        a = sorted_counts[:, 0]
+        b = sorted_counts[:, 1] if sorted_counts.shape[1] > 1 else np.zeros_like(a)
+        log_tail = beta_log_tail(a, b)
+        prob = -np.expm1(log_tail)
+        if conf_thresh < 1:
+            stop = log_tail <= np.log1p(-conf_thresh)
+        else:
+            stop = prob >= conf_thresh
+        return {'prob' : np.where(np.isnan(log_tail), -1, prob), 'stop' : stop}
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+
+        conf_threshs = np.asarray(conf_threshs, dtype = float)
+        log_tail = float(beta_log_tail(counts[0], counts[1] if len(counts) > 1 else 0))
+        if np.isnan(log_tail):
+            return {'prob' : -1, 'stop' : np.zeros(len(conf_threshs), dtype = bool)}
+        prob = float(-np.expm1(log_tail))
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            stop = np.where(conf_threshs < 1, log_tail <= np.log1p(-np.minimum(conf_threshs, 1)), prob >= conf_threshs)
+        return {'prob' : prob, 'stop' : stop}
+
 class RandomStoppingCriteria(StoppingCriterias):
 
-    def __init__(self, conf_thresh : float = 0.1) -> None:
+    def __init__(self, conf_thresh : float = 0.1, seed : int = None) -> None:
+        '''
+        Args:
+            conf_thresh (float): Probability of stopping at each check.
+            seed (int): If set, the draw for each count state comes from a generator seeded with (seed, counts),
+                which makes the decision a fixed (pseudo-random) function of the counts, so that it can be cached.
+        '''
         super().__init__()
         self.conf_thresh = conf_thresh
+        self.seed = seed
+
+    @property
+    def is_deterministic(self) -> bool:
+        return self.seed is not None
 
-    def should_stop(self, answers : List, conf_thresh : int = None, verbose : bool = False) -> Dict:
+    def min_additional_to_stop(self, counts : Sequence[int], max_additional : int = None, conf_thresh : float = None) -> Optional[int]:
+        # The decision does not depend on the counts, so any single further answer may stop
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+        if conf_thresh <= 0 or max_additional == 0:
+            return None
+        return 1
+
+    def _uniform(self, counts : Sequence[int]) -> float:
+        if self.seed is None:
+            return np.random.uniform(0,1)
+        return np.random.default_rng((self.seed, *(int(c) for c in counts if c > 0))).uniform(0,1)
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
         
         if conf_thresh is None: conf_thresh = self.conf_thresh
 
         return_dict = {
-            'most_common' : Counter(answers).most_common(1)[0][0],
             'prob' : 0,
-            'stop' : np.random.uniform(0,1) < conf_thresh,
+            'stop' : self._uniform(counts) < conf_thresh,
         }
         return return_dict
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+
+        if self.seed is None:
+            draws = np.random.uniform(0, 1, size = len(sorted_counts))
+        else:
+            draws = np.array([self._uniform(row) for row in sorted_counts])
+        return {
+            'prob' : np.zeros(len(sorted_counts)),
+            'stop' : draws < conf_thresh,
+        }
     
 class EntropyStoppingCriteria(StoppingCriterias):
 
@@ -75,25 +311,78 @@ class EntropyStoppingCriteria(StoppingCriterias):
         super().__init__()
         self.conf_thresh = conf_thresh
 
-    def should_stop(self, answers : List, conf_thresh : int = None, verbose : bool = False) -> Dict:
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
         
         if conf_thresh is None: conf_thresh = self.conf_thresh
 
-        counter = dict(Counter(answers))
-        lis = list(counter.values())
+        from scipy import stats
+
+        lis = list(counts)
         if len(lis) < 2:
             lis.append(1)
         entropy = stats.entropy(lis, base = 2)
         return_dict = {
-            'most_common' : Counter(answers).most_common(1)[0][0],
             'prob' : -1,
             'stop' : False,
         }
-        if len(answers) != 1:
+        if sum(counts) != 1:
             return_dict['stop'] = entropy/np.log2(len(lis)) <= conf_thresh
             return_dict['prob'] = entropy/np.log2(len(lis))
     
         return return_dict
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+
+        from scipy import special
+
+        counts = sorted_counts.astype(float)
+        num_distinct = (counts > 0).sum(axis = 1)
+        # Same as the scalar version: a single distinct answer is padded with a pseudo-count of 1
+        pad = (num_distinct < 2).astype(float)
+        total = counts.sum(axis = 1) + pad
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            entropy = (special.entr(counts / total[:, None]).sum(axis = 1) + special.entr(pad / total)) / np.log(2)
+            prob = entropy / np.log2(np.maximum(num_distinct, 2))
+        valid = counts.sum(axis = 1) != 1
+        return {
+            'prob' : np.where(valid, prob, -1),
+            'stop' : valid & (prob <= conf_thresh),
+        }
+
+    def is_futile(self, counts : Sequence[int], remaining : int, conf_thresh : float = None) -> bool:
+        '''
+        Exact check over every way to add up to `remaining` answers. Normalized entropy can also drop when answers go to
+        new distinct answers (the normalizer grows), so giving them all to the leader is not always the best case.
+
+        For m added answers of which j start new distinct answers, the split with the lowest entropy gives the new
+        answers one each and the rest to the leader: it majorizes every other such split, and entropy is Schur-concave.
+        So it suffices to check those O(remaining^2) states, in one batched call.
+        '''
+        counts = [int(c) for c in counts if c > 0]
+        rows = []
+        for m in range(max(0, remaining) + 1):
+            for j in range(m + 1):
+                if counts:
+                    rows.append([counts[0] + m - j] + counts[1:] + [1] * j)
+                elif j > 0:
+                    # No answers yet, so one of the new answers is the leader
+                    rows.append([m - j + 1] + [1] * (j - 1))
+        if not rows:
+            return True
+        sorted_counts = np.zeros((len(rows), max(len(row) for row in rows)), dtype = np.int64)
+        for i, row in enumerate(rows):
+            sorted_counts[i, :len(row)] = sorted(row, reverse = True)
+        return not self.should_stop_counts_batch(sorted_counts, conf_thresh)['stop'].any()
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+
+        prob = self.should_stop_counts(counts, 0)['prob']
+        conf_threshs = np.asarray(conf_threshs, dtype = float)
+        if sum(counts) == 1:
+            return {'prob' : prob, 'stop' : np.zeros(len(conf_threshs), dtype = bool)}
+        return {'prob' : prob, 'stop' : prob <= conf_threshs}
         
 class MajorityStoppingCriteria(StoppingCriterias):
 
@@ -101,113 +390,155 @@ class MajorityStoppingCriteria(StoppingCriterias):
         super().__init__()
         self.conf_thresh = conf_thresh
 
-    def should_stop(self, answers : List, conf_thresh : int = None, verbose : bool = False) -> Dict:
+    state_width = 1
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return (int(counts[0]), int(sum(counts)))
+
+    def min_additional_to_stop(self, counts : Sequence[int], max_additional : int = None, conf_thresh : float = None) -> Optional[int]:
+
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+        if not len(counts) or conf_thresh >= 1:
+            return super().min_additional_to_stop(counts, max_additional, conf_thresh)
+
+        # (leader + m) / (total + m) >= conf_thresh, solved for m
+        leader, total = counts[0], sum(counts)
+        m = max(0, int(np.ceil((conf_thresh * total - leader) / (1 - conf_thresh))))
+        # Guard against rounding and the single-answer case, where the criteria never stops
+        def stops(m):
+            return bool(self.should_stop_counts([leader + m] + list(counts[1:]), conf_thresh)['stop'])
+        while not stops(m):
+            m += 1
+        while m > 0 and stops(m - 1):
+            m -= 1
+        if max_additional is not None and m > max_additional:
+            return None
+        return m
+
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
         
         if conf_thresh is None: conf_thresh = self.conf_thresh
 
         return_dict = {
-            'most_common' : Counter(answers).most_common(1)[0][0],
             'prob' : -1,
             'stop' : False,
         }
-        if len(answers) != 1:
-            return_dict['stop'] = Counter(answers).most_common(1)[0][1]/len(answers) >= conf_thresh
-            return_dict['prob'] = Counter(answers).most_common(1)[0][1]/len(answers)
+        total = sum(counts)
+        if total != 1:
+            return_dict['stop'] = counts[0]/total >= conf_thresh
+            return_dict['prob'] = counts[0]/total
     
         return return_dict
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, conf_thresh : float = None) -> Dict:
+
+        if conf_thresh is None: conf_thresh = self.conf_thresh
+
+        total = sorted_counts.sum(axis = 1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            prob = sorted_counts[:, 0] / total
+        valid = total != 1
+        return {
+            'prob' : np.where(valid, prob, -1),
+            'stop' : valid & (prob >= conf_thresh),
+        }
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+
+        prob = self.should_stop_counts(counts, 0)['prob']
+        conf_threshs = np.asarray(conf_threshs, dtype = float)
+        if sum(counts) == 1:
+            return {'prob' : prob, 'stop' : np.zeros(len(conf_threshs), dtype = bool)}
+        return {'prob' : prob, 'stop' : prob >= conf_threshs}
     
 class DirichletStoppingCriteria(StoppingCriterias):
 
-    def __init__(self, conf_thresh : float = 0.95, top_k_elements : int = 5, use_markov : bool = True) -> None:
+    METHODS = ('mc', 'exact', 'qmc', 'nquad')
+
+    def __init__(self, conf_thresh : float = 0.95, top_k_elements : int = 5, use_markov : bool = True, num_samples : int = 50000, seed : int = None, method : str = None) -> None:
+        '''
+        Args:
+            conf_thresh (float): Stop once the probability that the leading answer is the true majority reaches this value.
+            top_k_elements (int): Number of most frequent answers considered.
+            use_markov (bool): Selects the Monte-Carlo method if True, and nested integration otherwise. Ignored if method is set.
+            num_samples (int): Number of posterior samples for the Monte-Carlo method, and the maximum for the quasi-Monte-Carlo one.
+            seed (int): Seed for the (quasi-)Monte-Carlo methods.
+            method (str): One of 'mc' (Monte-Carlo), 'exact' (deterministic 1-D quadrature), 'qmc' (scrambled Sobol
+                quasi-Monte-Carlo, which stops sampling once the decision against conf_thresh is clear) or 'nquad' (nested integration).
+        '''
         super().__init__()
+        if method is None:
+            method = 'mc' if use_markov else 'nquad'
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown Dirichlet method: {method}. Expected one of {self.METHODS}")
         self.conf_thresh = conf_thresh
         self.top_k_elements = top_k_elements
         self.use_markov = use_markov
+        self.num_samples = num_samples
+        self.seed = seed
+        self.method = method
+        if method == 'mc':
+            self._engine = DirichletMonteCarloEngine(num_samples = num_samples, seed = seed)
+        elif method == 'exact':
+            self._engine = DirichletQuadratureEngine()
+        elif method == 'qmc':
+            self._engine = DirichletQMCEngine(num_samples = num_samples, seed = seed)
+
+    @property
+    def state_width(self) -> int:
+        return self.top_k_elements
+
+    @property
+    def is_deterministic(self) -> bool:
+        return self.method not in ('mc', 'qmc') or self.seed is not None
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return tuple(int(c) for c in counts[:self.top_k_elements])
+
+    def integrate_nquad(self, counts : Sequence[int]) -> float:
+        '''
+        Probability that the leading answer wins, by nested numerical integration of the Dirichlet density. Very slow.
+        '''
+        from scipy import integrate
+
+        # Counts in increasing order, so that the leader takes up the remaining probability mass
+        counts = sorted(counts)
+
+        def integrand(*args):
+            return np.prod([x ** c for x, c in zip(args, counts[:-1])]) * (1 - sum(args)) ** counts[-1]
+
+        num_vars = len(counts) - 1
+        functions = [lambda *args: [0, max(0, min(0.5, 1 - sum(args) - max(args), (1-sum(args))/2))] for _ in range(num_vars - 1)]
+        denom_functions = [lambda *args: [0, 1 - sum(args)] for _ in range(num_vars - 1)]
+        # Outermost limit
+        functions.append(lambda *args: [0, 0.5])
+        denom_functions.append(lambda *args: [0, 1])
 
-    def integrate_mcs(self, f, limits, N = 10000):
-        ranges = []
-        samples = []
-
-        for _, funcs in enumerate(limits[::-1]):
-
-            if len(samples) == 0:
-                ranges.append(funcs())
-            else:
-                ranges.append(funcs(*samples[::-1]))
-                # TODO: Note, we assume, that the first value is actually a scalar.
-                try:
-                    ranges[-1][0] = ranges[-1][0][0]
-                except: ...
-
-            samples.append(np.random.uniform(*ranges[-1], size=N))
-        integrand_values = f(*samples) * np.prod([r[1] - r[0] for r in ranges], axis=0)
-
-        integral_approximation = (1/N) * np.sum(integrand_values)
-        return integral_approximation
-
+        opts = {'limit': 3, 'epsrel' : 1e-1,'epsabs': 1e-1}
+        return integrate.nquad(integrand, functions, opts = opts)[0] / integrate.nquad(integrand, denom_functions, opts = opts)[0]
 
-    def should_stop(self, answers : List, conf_thresh : int = None, verbose : bool = False) -> Dict:
+    def should_stop_counts(self, counts : Sequence[int], conf_thresh : float = None, verbose : bool = False) -> Dict:
         
         if conf_thresh is None: conf_thresh = self.conf_thresh
 
-        counts = dict(Counter(answers))
         if len(counts) < 3:
-            return BetaStoppingCriteria(conf_thresh).should_stop(answers, conf_thresh, verbose)
+            return BetaStoppingCriteria(conf_thresh).should_stop_counts(counts, conf_thresh, verbose)
         
-        most_common = Counter(answers).most_common(2)[0][0]
-        counts = {k: v for k, v in sorted(counts.items(), key=lambda item: item[1], reverse=False)[-self.top_k_elements:]}
-        len_counts = len(counts)
-
-        functions = []
-        functions2  =[]
-        for i, _ in enumerate(counts.items()):
-            if i == len_counts - 2:
-                break
-            if self.use_markov:
-                functions.append(lambda *args: [np.array([0 for _ in range(args[0].shape[0])]), np.max([np.array([0 for _ in range(args[0].shape[0])]), np.min([np.array([0.5 for _ in range(args[0].shape[0])]), 1 - np.sum(args, axis = 0) - np.max(args, axis = 0), (1-np.sum(args, axis = 0))/2], axis = 0)], axis = 0)])
-            else:
-                functions.append(lambda *args: [0, max(0, min(0.5, 1 - sum(args) - max(args), (1-sum(args))/2))])
-            functions2.append(lambda *args: [0, max(0, min(0.5, 1 - sum(args) - max(args), (1-sum(args))/2))])
-
-        # Outermost limit
-        functions.append(lambda *args: [0, 0.5])
-        functions2.append(lambda *args: [0, 0.5])
-
-        denom_functions = []
-        for i, _ in enumerate(counts.items()):
-            if i == len_counts - 2:
-                break
-            denom_functions.append(lambda *args: [0, 1-np.sum(args, axis = 0)])
-        # Outermost limit
-        denom_functions.append(lambda *args: [0, 1])
-        exec(
-            f'''def integrand({",".join(["a" + str(i) for i in range(len(functions))])}):
-                counts = {counts}
-                ks = list(counts.keys())
-                args = [{",".join(["a" + str(i) for i in range(len(functions))])}]
-
-                outp = np.prod([args[i] ** counts[k] for i, k in enumerate(list(counts.keys())[:-1])], axis = 0) * (1 - np.sum(args, axis = 0)) ** counts[list(counts.keys())[-1]]
-                return outp
-            '''
-        )
+        counts = counts[:self.top_k_elements]
 
         return_dict = {
-            'most_common' : most_common,
             'prob' : -1,
             'stop' : False,
         }
 
         try:
-            # print('Computing Integration')
-            opts = {}
-            opts = {'limit': 3, 'epsrel' : 1e-1,'epsabs': 1e-1}
-
-            if self.use_markov:
-                N = min(500000, 5000 * 2**len(functions))
-                N = 50000 * 1 if len(functions) <= 4 else 50000 * (2** ((len(functions) - 3)//2))
-                prob = self.integrate_mcs(locals()['integrand'], functions, N = N) / self.integrate_mcs(locals()['integrand'], denom_functions, N = N)
+            if self.method == 'nquad':
+                prob = self.integrate_nquad(counts)
+            elif self.method == 'qmc':
+                # Sampling stops as soon as the estimate is clearly on one side of the threshold
+                prob = self._engine.prob_leader_wins(counts, conf_thresh)
             else:
-                prob = integrate.nquad(locals()['integrand'], functions, opts = opts)[0] / integrate.nquad(locals()['integrand'], denom_functions, opts = opts)[0]
+                prob = self._engine.prob_leader_wins(counts)
             return_dict['prob'] = prob
             return_dict['stop'] = prob >= conf_thresh
 
@@ -216,16 +547,43 @@ class DirichletStoppingCriteria(StoppingCriterias):
             print(f"Error during numerical integration: {e}")
         
         return return_dict
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+
+        if len(counts) < 3:
+            return BetaStoppingCriteria().should_stop_counts_thresholds(counts, conf_threshs)
+        if self.method == 'qmc':
+            # The estimate depends on the threshold it was stopped against
+            return super().should_stop_counts_thresholds(counts, conf_threshs)
+        prob = self.should_stop_counts(counts, 0)['prob']
+        if prob == -1:
+            return {'prob' : prob, 'stop' : np.zeros(len(conf_threshs), dtype = bool)}
+        return {'prob' : prob, 'stop' : prob >= np.asarray(conf_threshs, dtype = float)}
     
 class AlwaysFalseStoppingCriteria(StoppingCriterias):
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__()
 
-    def should_stop(self, answers : List, *args, **kwargs) -> Dict:
+    state_width = 1
+
+    def signature(self, counts : Sequence[int]) -> tuple:
+        return ()
+
+    def should_stop_counts(self, counts : Sequence[int], *args, **kwargs) -> Dict:
         return {
-            'most_common' : Counter(answers).most_common(1)[0][0],
             'prob' : -1,
             'stop' : False,
         }
-    
\ No newline at end of file
+
+    def should_stop_counts_batch(self, sorted_counts : np.ndarray, *args, **kwargs) -> Dict:
+        return {
+            'prob' : np.full(len(sorted_counts), -1.),
+            'stop' : np.zeros(len(sorted_counts), dtype = bool),
+        }
+
+    def should_stop_counts_thresholds(self, counts : Sequence[int], conf_threshs : Sequence[float]) -> Dict:
+        return {'prob' : -1, 'stop' : np.zeros(len(conf_threshs), dtype = bool)}
+
+    def min_additional_to_stop(self, counts : Sequence[int], max_additional : int = None, conf_thresh : float = None) -> Optional[int]:
+        return None
@@ -0,0 +1,61 @@
+'''
+Compares the exact (1-D quadrature), Monte-Carlo and early-terminating quasi-Monte-Carlo Dirichlet stopping
+probabilities, for speed and agreement. QMC estimates are stopped against --conf_thresh, and are compared to the exact
+ones by their stopping decisions.
+
+Usage: python benchmarks/bench_dirichlet.py --num_states 200 --max_gens 40
+'''
+import argparse
+import time
+
+import numpy as np
+
+from adaptive_consistency.dirichlet import DirichletMonteCarloEngine, DirichletQMCEngine, DirichletQuadratureEngine
+
+
+def random_count_states(num_states, max_gens, top_k, rng):
+    states = []
+    while len(states) < num_states:
+        n = rng.integers(3, max_gens + 1)
+        probs = rng.dirichlet(np.ones(rng.integers(3, top_k + 1)))
+        counts = np.bincount(rng.choice(len(probs), size = n, p = probs))
+        counts = sorted(counts[counts > 0].tolist(), reverse = True)[:top_k]
+        if len(counts) >= 3:
+            states.append(counts)
+    return states
+
+
+def time_engine(engine, states, *args):
+    probs = []
+    latencies = []
+    for counts in states:
+        start = time.perf_counter()
+        probs.append(engine.prob_leader_wins(counts, *args))
+        latencies.append(time.perf_counter() - start)
+    return np.array(probs), np.array(latencies)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_states', type = int, default = 200)
+    parser.add_argument('--max_gens', type = int, default = 40)
+    parser.add_argument('--num_samples', type = int, default = 50000)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--conf_thresh', type = float, default = 0.95)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    qmc_engine = DirichletQMCEngine(num_samples = args.num_samples, seed = args.seed, cache_size = 0)
+    # Generates the Sobol points once, outside of the timings
+    qmc_engine.prob_leader_wins([3, 2, 1])
+    print(f'{"top_k":>5} {"exact ms":>9} {"mc ms":>9} {"speedup":>8} {"max |diff|":>11} {"mean |diff|":>12} {"qmc ms":>9} {"qmc points":>11} {"qmc agree":>10}')
+    for top_k in [3, 5, 8, 12]:
+        states = random_count_states(args.num_states, args.max_gens, top_k, rng)
+        exact_probs, exact_latency = time_engine(DirichletQuadratureEngine(cache_size = 0), states)
+        mc_probs, mc_latency = time_engine(DirichletMonteCarloEngine(num_samples = args.num_samples), states)
+        qmc_probs, qmc_latency = time_engine(qmc_engine, states, args.conf_thresh)
+        qmc_points = np.mean([qmc_engine.estimate(counts, args.conf_thresh)[2] for counts in states])
+        qmc_agree = np.mean((qmc_probs >= args.conf_thresh) == (exact_probs >= args.conf_thresh))
+        diff = np.abs(exact_probs - mc_probs)
+        print(f'{top_k:>5} {exact_latency.mean() * 1e3:>9.3f} {mc_latency.mean() * 1e3:>9.3f} {mc_latency.mean() / exact_latency.mean():>7.1f}x {diff.max():>11.4f} {diff.mean():>12.4f} {qmc_latency.mean() * 1e3:>9.3f} {qmc_points:>11.0f} {qmc_agree * 100:>9.1f}%')
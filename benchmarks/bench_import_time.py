@@ -0,0 +1,65 @@
+'''
+Measures the time to `import adaptive_consistency` in fresh interpreters, and guards that heavy dependencies are only
+loaded by the criteria that need them.
+
+Each check runs a snippet in a new process and lists the guarded modules it loaded. The run fails (exit status 1) if a
+snippet loads a module it should not, or if the median import time exceeds --max_ms.
+
+Usage: python benchmarks/bench_import_time.py --repeats 10 --max_ms 500
+'''
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# Modules that must not be loaded by `import adaptive_consistency` alone
+GUARDED_MODULES = ['scipy', 'asyncio']
+
+# Snippets run after the import, and the guarded modules each is allowed to load
+CHECKS = {
+    'import' : ('', []),
+    'majority' : ("adaptive_consistency.MajorityStoppingCriteria().should_stop(['a', 'a', 'b'])", []),
+    'session' : ("s = adaptive_consistency.AC(stop_criteria = 'majority').session(); s.extend(['a', 'b', 'a']); s.should_stop()", []),
+    'beta' : ("adaptive_consistency.BetaStoppingCriteria().should_stop(['a', 'a', 'b'])", ['scipy']),
+}
+
+SNIPPET = '''
+import sys, time, json
+start = time.perf_counter()
+import adaptive_consistency
+elapsed = time.perf_counter() - start
+{check}
+print(json.dumps({{'import_ms' : elapsed * 1e3, 'loaded' : [m for m in {guarded} if m in sys.modules]}}))
+'''
+
+
+def run_check(check):
+    outp = subprocess.run([sys.executable, '-c', SNIPPET.format(check = check, guarded = GUARDED_MODULES)], capture_output = True, text = True, check = True)
+    return json.loads(outp.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', type = int, default = 10, help = 'Number of fresh interpreters to time the import in')
+    parser.add_argument('--max_ms', type = float, default = None, help = 'Fail if the median import time exceeds this')
+    args = parser.parse_args()
+
+    failures = []
+    for name, (check, allowed) in CHECKS.items():
+        loaded = run_check(check)['loaded']
+        unexpected = sorted(set(loaded) - set(allowed))
+        print(f"{name:<10} loaded {', '.join(loaded) if loaded else 'no guarded modules'}")
+        if unexpected:
+            failures.append(f'{name} loaded {unexpected}')
+
+    times = np.array([run_check('')['import_ms'] for _ in range(args.repeats)])
+    print(f'import adaptive_consistency: median {np.median(times):.1f} ms, min {times.min():.1f} ms, max {times.max():.1f} ms over {args.repeats} runs')
+    if args.max_ms is not None and np.median(times) > args.max_ms:
+        failures.append(f'median import time {np.median(times):.1f} ms exceeds {args.max_ms} ms')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,141 @@
+'''
+Microbenchmarks `should_stop` for every stopping criteria, across a matrix of answer counts, numbers of distinct answers
+and thresholds. Records mean and p99 latency and peak memory per case, and compares them against a saved baseline.
+
+Dirichlet engines are benchmarked with their result caches disabled, so that every call is a cold decision.
+
+Usage:
+    python benchmarks/bench_stopping_criterias.py --save_baseline baseline.json
+    python benchmarks/bench_stopping_criterias.py --baseline baseline.json --margin 0.25
+'''
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from adaptive_consistency import stop_criteria_dict
+from adaptive_consistency.stopping_criterias import DirichletStoppingCriteria, RandomStoppingCriteria
+
+
+CRITERIA = {
+    'beta' : lambda thresh: stop_criteria_dict['beta'](conf_thresh = thresh),
+    'majority' : lambda thresh: stop_criteria_dict['majority'](conf_thresh = thresh),
+    'entropy' : lambda thresh: stop_criteria_dict['entropy'](conf_thresh = thresh),
+    'random' : lambda thresh: RandomStoppingCriteria(conf_thresh = 1 - thresh, seed = 0),
+    'dirichlet_mc' : lambda thresh: DirichletStoppingCriteria(conf_thresh = thresh, method = 'mc', seed = 0),
+    'dirichlet_exact' : lambda thresh: DirichletStoppingCriteria(conf_thresh = thresh, method = 'exact'),
+    'dirichlet_qmc' : lambda thresh: DirichletStoppingCriteria(conf_thresh = thresh, method = 'qmc', seed = 0),
+    'always_false' : lambda thresh: stop_criteria_dict['always_false'](),
+}
+
+
+def make_answers(num_answers, num_distinct, seed = 0):
+    '''
+    A fixed list of num_answers answers with num_distinct distinct values and a geometric spread of counts.
+    '''
+    rng = np.random.default_rng((seed, num_answers, num_distinct))
+    weights = 0.5 ** np.arange(num_distinct)
+    counts = 1 + rng.multinomial(num_answers - num_distinct, weights / weights.sum())
+    answers = np.repeat(np.arange(num_distinct), counts)
+    rng.shuffle(answers)
+    return [f'answer_{a}' for a in answers.tolist()]
+
+def bench_case(criterion, answers, repeats = 100, warmup = 5):
+    '''
+    Times criterion.should_stop on a fixed answer list.
+
+    Returns:
+        Dict: Mean and p99 latency in microseconds, and peak traced memory in KiB of a single call.
+    '''
+    for _ in range(warmup):
+        criterion.should_stop(answers)
+
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        criterion.should_stop(answers)
+        latencies[i] = time.perf_counter() - start
+
+    # Measured separately, since tracing slows allocations down
+    tracemalloc.start()
+    criterion.should_stop(answers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'mean_us' : float(latencies.mean() * 1e6),
+        'p99_us' : float(np.percentile(latencies, 99) * 1e6),
+        'peak_kib' : peak / 1024,
+    }
+
+def run_suite(criteria, num_answers_list, num_distinct_list, threshs, repeats):
+    results = {}
+    for name in criteria:
+        for thresh in threshs:
+            criterion = CRITERIA[name](thresh)
+            if getattr(criterion, '_engine', None) is not None:
+                criterion._engine.cache_size = 0
+            for num_answers in num_answers_list:
+                for num_distinct in num_distinct_list:
+                    if num_distinct > num_answers:
+                        continue
+                    key = f'{name}/n={num_answers}/k={num_distinct}/t={thresh}'
+                    results[key] = bench_case(criterion, make_answers(num_answers, num_distinct), repeats)
+                    print(f"{key:<40}{results[key]['mean_us']:>12.2f}{results[key]['p99_us']:>12.2f}{results[key]['peak_kib']:>12.1f}")
+    return results
+
+def compare(results, baseline, margin = 0.25, min_abs_us = 5., min_abs_kib = 16.):
+    '''
+    Cases whose mean latency or peak memory grew by more than margin (relative) and the absolute floor, vs the baseline.
+    '''
+    regressions = []
+    for key, outp in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric, floor in (('mean_us', min_abs_us), ('peak_kib', min_abs_kib)):
+            if outp[metric] > base[metric] * (1 + margin) and outp[metric] - base[metric] > floor:
+                regressions.append((key, metric, base[metric], outp[metric]))
+    return regressions
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--criteria', type = str, nargs = '+', default = list(CRITERIA), choices = list(CRITERIA))
+    parser.add_argument('--num_answers', type = int, nargs = '+', default = [5, 20, 40])
+    parser.add_argument('--num_distinct', type = int, nargs = '+', default = [1, 2, 3, 5, 10])
+    parser.add_argument('--thresholds', type = float, nargs = '+', default = [0.8, 0.95])
+    parser.add_argument('--repeats', type = int, default = 100)
+    parser.add_argument('--save_baseline', type = str, default = None, help = 'Write the results to this JSON file')
+    parser.add_argument('--baseline', type = str, default = None, help = 'Compare against this JSON baseline, and exit with status 1 on regressions')
+    parser.add_argument('--margin', type = float, default = 0.25, help = 'Allowed relative slowdown (or memory growth) vs the baseline')
+    parser.add_argument('--min_abs_us', type = float, default = 5., help = 'Ignore slowdowns smaller than this many microseconds')
+    args = parser.parse_args()
+
+    print(f"{'case':<40}{'mean us':>12}{'p99 us':>12}{'peak KiB':>12}")
+    results = run_suite(args.criteria, args.num_answers, args.num_distinct, args.thresholds, args.repeats)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({
+                'machine' : {'python' : platform.python_version(), 'numpy' : np.__version__, 'platform' : platform.platform(), 'processor' : platform.processor()},
+                'results' : results,
+            }, f, indent = 2)
+        print(f'Saved baseline to {args.save_baseline}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.margin, args.min_abs_us)
+        missing = sorted(set(results) - set(baseline))
+        if missing:
+            print(f'{len(missing)} cases are not in the baseline')
+        for key, metric, before, after in regressions:
+            print(f'REGRESSION {key} {metric}: {before:.2f} -> {after:.2f} ({(after / before - 1) * 100:+.1f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.margin * 100:.0f}% against {args.baseline}')
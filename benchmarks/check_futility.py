@@ -0,0 +1,70 @@
+'''
+Checks `is_futile` against a brute-force search over every sequence of the remaining answers, for small count states.
+A criterion that reports futility while some sequence still stops would end sampling too early under `--futility`.
+
+Exits with status 1 on any disagreement. Includes the Entropy states (4, 3) with 1 remaining answer at 0.95, and with 4
+remaining at 0.8, where only answers to the runner-up or to new answers can make it stop.
+
+Usage: python benchmarks/check_futility.py --max_total 8 --max_remaining 5
+'''
+import argparse
+import sys
+
+from adaptive_consistency import stop_criteria_dict
+from adaptive_consistency.policy import iter_count_states
+
+
+CRITERIA = ['beta', 'majority', 'entropy']
+
+# (criteria, counts, remaining, conf_thresh) that must not be futile
+REGRESSIONS = [
+    ('entropy', (4, 3), 1, 0.95),
+    ('entropy', (4, 3), 4, 0.8),
+]
+
+
+def brute_force_futile(criterion, counts, remaining, conf_thresh):
+    '''
+    Whether no sequence of up to `remaining` answers, to existing or new distinct answers, makes the criteria stop.
+    '''
+    states = {tuple(sorted(counts, reverse = True))}
+    for _ in range(remaining + 1):
+        for state in states:
+            if sum(state) > 0 and criterion.should_stop_counts(list(state), conf_thresh)['stop']:
+                return False
+        next_states = set()
+        for state in states:
+            for i in range(len(state)):
+                next_states.add(tuple(sorted(state[:i] + (state[i] + 1,) + state[i + 1:], reverse = True)))
+            next_states.add(tuple(sorted(state + (1,), reverse = True)))
+        states = next_states
+    return True
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--criteria', type = str, nargs = '+', default = CRITERIA, choices = list(stop_criteria_dict))
+    parser.add_argument('--thresholds', type = float, nargs = '+', default = [0.5, 0.75, 0.8, 0.95])
+    parser.add_argument('--max_total', type = int, default = 8, help = 'Check every count state with up to this many answers')
+    parser.add_argument('--max_remaining', type = int, default = 5)
+    args = parser.parse_args()
+
+    cases = list(REGRESSIONS)
+    for name in args.criteria:
+        for counts in [()] + list(iter_count_states(args.max_total)):
+            for remaining in range(args.max_remaining + 1):
+                for conf_thresh in args.thresholds:
+                    cases.append((name, counts, remaining, conf_thresh))
+
+    failures = []
+    criteria = {name : stop_criteria_dict[name]() for name in set(name for name, _, _, _ in cases)}
+    for name, counts, remaining, conf_thresh in cases:
+        expected = brute_force_futile(criteria[name], counts, remaining, conf_thresh)
+        if criteria[name].is_futile(list(counts), remaining, conf_thresh) != expected:
+            failures.append((name, counts, remaining, conf_thresh, expected))
+
+    print(f'Checked {len(cases)} cases')
+    for name, counts, remaining, conf_thresh, expected in failures:
+        print(f'FAIL {name} counts={counts} remaining={remaining} conf_thresh={conf_thresh}: expected futile={expected}')
+    if failures:
+        sys.exit(1)
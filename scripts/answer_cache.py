@@ -0,0 +1,171 @@
+import json
+import os
+
+import numpy as np
+
+from jsonl_reader import read_jsonl
+
+# Bump when the layout of the sidecar changes, so that stale sidecars are rebuilt
+CACHE_VERSION = 1
+
+
+def answers_are_strings(output_file):
+    '''
+    Whether the answers of an outputs file are compared as strings. Only the arithmetic datasets have numeric answers.
+    '''
+    return not ('gsm' in output_file or 'asdiv' in output_file or 'svamp' in output_file)
+
+def parse_answer(answer, eval_as_str = False):
+    '''
+    Parses a raw answer, returning None if it is blank (string answers) or not a number (numeric answers).
+    '''
+    try:
+        if eval_as_str:
+            if str(answer).strip() == '':
+                return None
+            return str(answer)
+        return float(answer)
+    except: ...
+    return None
+
+def is_correct(majority_val, target, eval_as_str = False):
+    try:
+        if eval_as_str:
+            return str(majority_val).strip() == str(target).strip()
+        return abs(float(str(majority_val).strip()) - float(target)) < 1e-3
+    except Exception as e:
+        print('Error', majority_val, e)
+        return False
+
+def cache_path(output_file):
+    '''
+    Path of the answer cache sidecar of an outputs file.
+    '''
+    return os.path.splitext(output_file)[0] + '.answers.npz'
+
+
+class AnswerCache:
+    '''
+    Columnar form of an outputs file, holding only what a replay needs.
+
+    Answers are parsed once and interned per question, in first-seen order, so that replays feed small integers to the
+    stopping criteria and look up correctness by id instead of re-parsing the JSON records.
+
+    Args:
+        answer_ids (np.ndarray): (questions, max_gens) answer ids, -1 for unparseable answers and padding.
+        num_samples (np.ndarray): Number of stored samples per question.
+        correct (np.ndarray): (questions, max_gens) correctness of each answer id.
+        target_ids (np.ndarray): Id of the first answer matching the target per question, -1 if none did.
+        eval_as_str (bool): Whether answers were compared as strings.
+    '''
+
+    def __init__(self, answer_ids, num_samples, correct, target_ids, eval_as_str = False):
+        self.answer_ids = answer_ids
+        self.num_samples = num_samples
+        self.correct = correct
+        self.target_ids = target_ids
+        self.eval_as_str = eval_as_str
+
+    def __len__(self):
+        return len(self.num_samples)
+
+    def __getitem__(self, index):
+        '''
+        The cache of a range of questions, e.g. `cache[start:stop]`.
+        '''
+        if not isinstance(index, slice):
+            raise TypeError(f"AnswerCache only supports slicing, got {type(index).__name__}")
+        return AnswerCache(self.answer_ids[index], self.num_samples[index], self.correct[index], self.target_ids[index], self.eval_as_str)
+
+    @classmethod
+    def from_records(cls, dt, eval_as_str = False):
+        '''
+        Builds the cache from the records of an outputs file.
+        '''
+        num_samples = np.array([len(x['scores']) for x in dt], dtype = np.int32)
+        width = max(int(num_samples.max()) if len(dt) else 0, 1)
+        answer_ids = np.full((len(dt), width), -1, dtype = np.int32)
+        correct = np.zeros((len(dt), width), dtype = bool)
+        target_ids = np.full(len(dt), -1, dtype = np.int32)
+        for q, x in enumerate(dt):
+            ids = {}
+            for m, answer in enumerate(x['answers'][:num_samples[q]]):
+                answer = parse_answer(answer, eval_as_str)
+                if answer is None:
+                    continue
+                answer_id = ids.get(answer)
+                if answer_id is None:
+                    answer_id = ids[answer] = len(ids)
+                    correct[q, answer_id] = is_correct(answer, x['target'], eval_as_str)
+                answer_ids[q, m] = answer_id
+            matches = np.flatnonzero(correct[q])
+            if len(matches):
+                target_ids[q] = matches[0]
+        return cls(answer_ids, num_samples, correct, target_ids, eval_as_str)
+
+    def records(self, start = 0, stop = None, max_gens = None):
+        '''
+        Yields (answers, num_samples, is_correct) for the questions [start, stop), where answers holds the answer ids
+        (None for unparseable answers) and is_correct maps an answer id to whether it matches the target.
+        '''
+        stop = len(self) if stop is None else stop
+        for q in range(start, stop):
+            num_samples = int(self.num_samples[q]) if max_gens is None else min(int(self.num_samples[q]), max_gens)
+            answers = [i if i >= 0 else None for i in self.answer_ids[q, :num_samples].tolist()]
+            yield answers, num_samples, self.correct[q].__getitem__
+
+    def save(self, path, source_file):
+        '''
+        Saves the cache, keyed by the size and modification time of the outputs file it was built from.
+        '''
+        stat = os.stat(source_file)
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(
+            tmp_path,
+            answer_ids = self.answer_ids,
+            num_samples = self.num_samples,
+            correct = self.correct,
+            target_ids = self.target_ids,
+            eval_as_str = self.eval_as_str,
+            source = json.dumps({'version' : CACHE_VERSION, 'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns}),
+        )
+        # Atomic, so that concurrent readers never see a partially written sidecar
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, source_file = None, eval_as_str = None):
+        '''
+        Loads a cache saved with `save`. Returns None if it is missing, or stale with respect to source_file and eval_as_str.
+        '''
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if source_file is not None:
+                    stat = os.stat(source_file)
+                    if json.loads(str(data['source'])) != {'version' : CACHE_VERSION, 'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns}:
+                        return None
+                if eval_as_str is not None and bool(data['eval_as_str']) != eval_as_str:
+                    return None
+                return cls(data['answer_ids'], data['num_samples'], data['correct'], data['target_ids'], bool(data['eval_as_str']))
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def load_answer_cache(output_file, eval_as_str = None, save = True):
+    '''
+    Returns the answer cache of an outputs file, building (and saving) it if the sidecar is missing or stale.
+    '''
+    if eval_as_str is None:
+        eval_as_str = answers_are_strings(output_file)
+    path = cache_path(output_file)
+    cache = AnswerCache.load(path, output_file, eval_as_str)
+    if cache is None:
+        cache = AnswerCache.from_records(read_jsonl(output_file, fields = ('answers', 'scores', 'target')), eval_as_str)
+        if save:
+            try:
+                cache.save(path, output_file)
+            except OSError:
+                # Read-only outputs directory, so the cache is rebuilt on every run
+                pass
+    return cache
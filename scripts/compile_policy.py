@@ -0,0 +1,26 @@
+import argparse
+import time
+
+from adaptive_consistency import compile_policy, stop_criteria_dict
+
+if __name__ == '__main__':
+
+    # Usage: python scripts/compile_policy.py --stop_criteria beta --stop_criteria_thresh 0.95 --max_gens 40 --output_file policies/beta_0.95_40.npz
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stop_criteria', type=str, required=True)
+    parser.add_argument('--stop_criteria_thresh', type=float, required=False, default=None)
+    parser.add_argument('--max_gens', type=int, default=40)
+    parser.add_argument('--output_file', type=str, required=True)
+
+    args = parser.parse_args()
+
+    if args.stop_criteria_thresh is None or args.stop_criteria_thresh == -1:
+        criterion = stop_criteria_dict[args.stop_criteria]()
+    else:
+        criterion = stop_criteria_dict[args.stop_criteria](conf_thresh = args.stop_criteria_thresh)
+
+    start = time.time()
+    policy = compile_policy(criterion, max_gens = args.max_gens)
+    policy.save(args.output_file)
+    print(f'Compiled {len(policy.stop)} count states in {time.time() - start:.2f}s ({policy.stop.mean()*100:.1f}% stop) to {args.output_file}')
@@ -1,75 +1,337 @@
 from tqdm import tqdm
 import argparse
 from adaptive_consistency import AC, stop_criteria_dict
-import json
+import csv
+import numpy as np
+from answer_cache import AnswerCache, answers_are_strings, is_correct, load_answer_cache, parse_answer
+from jsonl_reader import read_jsonl
+
+def iter_records(dt, max_gens = 40, eval_as_str = False):
+    '''
+    Yields (answers, num_samples, is_correct) per question, from either the records of an outputs file or its
+    AnswerCache. Answers are parsed (None if unparseable) and truncated to max_gens, and is_correct maps an answer to
+    whether it matches the target.
+    '''
+    if isinstance(dt, AnswerCache):
+        yield from dt.records(max_gens = max_gens)
+        return
+    for x in dt:
+        answers = [parse_answer(xx, eval_as_str) for xx in x['answers'][:max_gens]]
+        yield answers, len(x['scores'][:max_gens]), lambda val, target = x['target']: is_correct(val, target, eval_as_str)
+
+def replay(answers, num_samples, ac, min_gens = 1):
+    '''
+    Replays Adaptive Consistency over the stored samples of one question.
+
+    The parsed answers are fed to an incremental session, one prefix at a time. The stopping criteria is only evaluated
+    when the count signature changes, since deterministic criteria give the same decision otherwise.
+
+    Returns:
+        Tuple[int, Any]: The number of generations used and the majority answer (None if no answer was valid).
+    '''
+    session = ac.session()
+    criterion = ac.stop_criteria
+    reuse = criterion.is_deterministic
+    signature, outp = None, None
+    for m in range(1, num_samples + 1):
+        if m <= len(answers) and answers[m - 1] is not None:
+            session.add(answers[m - 1])
+        if m < min_gens or len(session) == 0:
+            continue
+
+        new_signature = criterion.signature(session.sorted_counts)
+        if not reuse or new_signature != signature:
+            signature = new_signature
+            outp = criterion.should_stop_counts(session.sorted_counts, verbose = ac.verbose)
+        should_stop = dict(outp)
+        ac.check_futility(should_stop, lambda: session.sorted_counts, num_samples - m)
+        if should_stop['stop']:
+            return m, session.most_common
+    return num_samples, session.most_common
 
 def main(dt, ac, min_gens = 1, max_gens = 40, eval_as_str = False):
     
     correct_answers = 0
     total_answers = len(dt)
     total_gens = 0
-    for _, x in tqdm(enumerate(dt), total = len(dt)):
-        x = {k: (v[:max_gens] if isinstance(v, list) else v) for k, v in x.items() }
-        for m in range(min_gens, len(x['scores'])+1):
-            answers = x['answers'][:m]
-            new_answers = []
-            for _, xx in enumerate(answers):
-                try: 
-                    if eval_as_str:
-                        if str(xx).strip()=='':
-                            continue
-                        new_answers.append(str(xx))
-                    else:
-                        new_answers.append(float(xx))
-                except: ...
-            if len(new_answers) == 0: 
-                if m == len(x['scores']):
-                    total_gens += m
+    for answers, num_samples, correct in tqdm(iter_records(dt, max_gens, eval_as_str), total = len(dt)):
+        num_gens, majority_val = replay(answers, num_samples, ac, min_gens)
+        total_gens += num_gens
+        if majority_val is not None and correct(majority_val):
+            correct_answers += 1
+    return correct_answers, total_answers, total_gens
+
+def sweep(dt, criteria, conf_threshs, min_gens = 1, max_gens = 40, eval_as_str = False, futility = False, progress = True):
+    '''
+    Replays every (criteria, threshold) setting in a single pass over the outputs.
+
+    Each record's answers are parsed and counted once. At every prefix, each criteria evaluates its count state once
+    for all of the thresholds that have not stopped yet (see `should_stop_counts_thresholds`).
+
+    Args:
+        dt (Union[List[Dict], AnswerCache]): The records of an outputs file, or its answer cache.
+        criteria (Dict[str, StoppingCriterias]): The criteria to sweep, by name.
+        conf_threshs (List[float]): The thresholds to sweep.
+        progress (bool): Whether to show a progress bar.
+
+    Returns:
+        List[Dict]: One row per setting, with the number of correct answers and generations, accuracy and average generations.
+    '''
+    conf_threshs = np.asarray(conf_threshs, dtype = float)
+    correct = {name : np.zeros(len(conf_threshs), dtype = int) for name in criteria}
+    gens = {name : np.zeros(len(conf_threshs), dtype = int) for name in criteria}
+    for answers, num_samples, matches_target in tqdm(iter_records(dt, max_gens, eval_as_str), total = len(dt), disable = not progress):
+        session = AC(max_gens = max(num_samples, 1)).session()
+        num_gens = {name : np.full(len(conf_threshs), num_samples) for name in criteria}
+        majority = {name : [None] * len(conf_threshs) for name in criteria}
+        active = {name : np.ones(len(conf_threshs), dtype = bool) for name in criteria}
+        last = {name : (None, None) for name in criteria}
+        for m in range(1, num_samples + 1):
+            if m <= len(answers) and answers[m - 1] is not None:
+                session.add(answers[m - 1])
+            if m < min_gens or len(session) == 0:
                 continue
-            outp = ac.should_stop(new_answers, return_dict = True)
-            majority_val, majority_bool = outp['most_common'], outp['stop']
-
-
-            if majority_bool or (m == len(x['scores'])):
-                total_gens += m
-                try:
-                    if eval_as_str:
-                        if str(majority_val).strip() == str(x['target']).strip():
-                            correct_answers += 1
-                            break
-                    else:
-                        if abs(float(str(majority_val).strip()) - float(x['target'])) < 1e-3:
-                            correct_answers += 1
-                            break
-                except Exception as e:
-                    print('Error', majority_val, m, e)
-                    break
+            for name, criterion in criteria.items():
+                if not active[name].any():
+                    continue
+                signature = criterion.signature(session.sorted_counts)
+                if not criterion.is_deterministic or signature != last[name][0]:
+                    last[name] = (signature, criterion.should_stop_counts_thresholds(session.sorted_counts, conf_threshs)['stop'])
+                stop = last[name][1] & active[name]
+                if futility:
+                    for i in np.flatnonzero(active[name] & ~stop):
+                        stop[i] = criterion.is_futile(session.sorted_counts, num_samples - m, conf_threshs[i])
+                if m == num_samples:
+                    stop = active[name]
+                for i in np.flatnonzero(stop):
+                    num_gens[name][i], majority[name][i] = m, session.most_common
+                active[name] &= ~stop
+            if not any(a.any() for a in active.values()):
                 break
-    return correct_answers, total_answers, total_gens
+
+        for name in criteria:
+            gens[name] += num_gens[name]
+            for i, majority_val in enumerate(majority[name]):
+                if majority_val is not None and matches_target(majority_val):
+                    correct[name][i] += 1
+
+    rows = []
+    for name in criteria:
+        for i, conf_thresh in enumerate(conf_threshs):
+            rows.append({
+                'stop_criteria' : name,
+                'stop_criteria_thresh' : float(conf_thresh),
+                'correct' : int(correct[name][i]),
+                'total' : len(dt),
+                'total_gens' : int(gens[name][i]),
+                'accuracy' : correct[name][i] / max(len(dt), 1) * 100,
+                'average_gens' : gens[name][i] / max(len(dt), 1),
+            })
+    return rows
+
+class DecisionTable:
+    '''
+    Stop decisions of a stopping criteria per count state, filled lazily so that each distinct state is evaluated once.
+
+    States are keyed by their total and leading `state_width` counts, which is at least as fine as the criteria's
+    signature, packed into one integer. Small key spaces (e.g. Beta or Majority) are held in a dense array, larger
+    ones in a dict.
+
+    Args:
+        criterion (StoppingCriterias): The criteria to evaluate. Should be deterministic.
+        max_count (int): Upper bound on the number of answers per question.
+        max_dense (int): Largest key space held in a dense array.
+    '''
+
+    def __init__(self, criterion, max_count = 1000, max_dense = 1 << 24):
+        self.criterion = criterion
+        self.base = max_count + 1
+        self.max_dense = max_dense
+        self._dense = {}
+        self._table = {}
+
+    def lookup(self, sorted_counts, totals = None):
+        '''
+        Stop decision per row of sorted_counts (count states sorted in non-increasing order, zero-padded).
+        '''
+        width = sorted_counts.shape[1] if self.criterion.state_width is None else min(self.criterion.state_width, sorted_counts.shape[1])
+        if totals is None:
+            totals = sorted_counts.sum(axis = 1)
+        if (width + 1) * np.log2(self.base) >= 62:
+            return self._lookup_rows(sorted_counts, np.concatenate([totals[:, None], sorted_counts[:, :width]], axis = 1))
+
+        # Trailing zero counts do not change the key, so questions with different numbers of distinct answers share entries
+        powers = self.base ** np.arange(1, width + 1, dtype = np.int64)
+        keys = totals.astype(np.int64) + sorted_counts[:, :width].astype(np.int64) @ powers
+        size = self.base ** (width + 1)
+        if size > self.max_dense:
+            return self._lookup_keys(sorted_counts, keys)
+
+        dense = self._dense.get(width)
+        if dense is None:
+            dense = self._dense[width] = np.full(size, -1, dtype = np.int8)
+        stop = dense[keys]
+        unknown = stop < 0
+        if unknown.any():
+            new_keys, index = np.unique(keys[unknown], return_index = True)
+            dense[new_keys] = self._evaluate(sorted_counts[unknown][index])
+            stop = dense[keys]
+        return stop.astype(bool)
+
+    def _evaluate(self, states):
+        return self.criterion.should_stop_counts_batch(states)['stop'] & (states.sum(axis = 1) > 0)
+
+    def _lookup_keys(self, sorted_counts, keys):
+        keys, index, inverse = np.unique(keys, return_index = True, return_inverse = True)
+        return self._fill([int(key) for key in keys], sorted_counts, index, inverse)
+
+    def _lookup_rows(self, sorted_counts, cols):
+        keys, index, inverse = np.unique(cols, axis = 0, return_index = True, return_inverse = True)
+        return self._fill([tuple(row[:np.count_nonzero(row)]) for row in keys.tolist()], sorted_counts, index, inverse)
+
+    def _fill(self, keys, sorted_counts, index, inverse):
+        missing = [i for i, key in enumerate(keys) if key not in self._table]
+        if missing:
+            self._table.update(zip((keys[i] for i in missing), self._evaluate(sorted_counts[index[missing]]).tolist()))
+        return np.array([self._table[key] for key in keys], dtype = bool)[inverse.reshape(-1)]
+
+def permutation_replay(cache, criterion, num_permutations = 1000, min_gens = 1, max_gens = 40, seed = 0, confidence = 0.95, progress = True):
+    '''
+    Replays Adaptive Consistency over many random orderings of each question's stored samples.
+
+    For each question, the cumulative answer counts of all permutations are built at once as an array of shape
+    (permutations, samples, answers), and the stop decisions of their count states are looked up from a table shared
+    by all questions (see `DecisionTable`). The majority answer at the stopping point breaks ties by first
+    occurrence in the permuted order, as in a sequential replay.
+
+    Args:
+        cache (AnswerCache): The answers of an outputs file.
+        criterion (StoppingCriterias): The stopping criteria.
+        num_permutations (int): Number of random orderings per question.
+        seed (int): Seed for the permutations.
+        confidence (float): Coverage of the reported intervals.
+
+    Returns:
+        Dict: Mean accuracy (in %) and average generations over the permutations, with normal-approximation confidence
+        intervals of these means ('accuracy_ci', 'average_gens_ci'), the central `confidence` range of the individual
+        permutations ('accuracy_spread', 'average_gens_spread'), and the per-permutation values.
+    '''
+    from scipy import special
+    rng = np.random.default_rng(seed)
+    table = DecisionTable(criterion, max_gens)
+    correct = np.zeros(num_permutations)
+    gens = np.zeros(num_permutations)
+    rows = np.arange(num_permutations)
+    for q in tqdm(range(len(cache)), disable = not progress):
+        n = min(int(cache.num_samples[q]), max_gens)
+        if n == 0:
+            continue
+        ids = cache.answer_ids[q, :n]
+        num_distinct = max(int(ids.max()) + 1, 1)
+
+        perm = rng.permuted(np.tile(np.arange(n), (num_permutations, 1)), axis = 1)
+        perm_ids = ids[perm]
+        counts = np.cumsum(perm_ids[..., None] == np.arange(num_distinct), axis = 1, dtype = np.int16)
+        totals = np.cumsum(perm_ids >= 0, axis = 1)
+        sorted_counts = counts.reshape(-1, num_distinct) if num_distinct == 1 else -np.sort(-counts.reshape(-1, num_distinct), axis = 1)
+        if criterion.is_deterministic:
+            stop = table.lookup(sorted_counts, totals.reshape(-1))
+        else:
+            stop = criterion.should_stop_counts_batch(sorted_counts)['stop']
+        stop = stop.reshape(num_permutations, n) & (totals > 0)
+        stop[:, :min_gens - 1] = False
+        stop[:, -1] = True
+
+        last = stop.argmax(axis = 1)
+        final = counts[rows, last].astype(np.int64)
+        first_seen = (counts == 0).sum(axis = 1)
+        leader = np.argmax(final * (n + 1) - first_seen, axis = 1)
+        gens += last + 1
+        correct += cache.correct[q, leader] & (totals[rows, last] > 0)
+
+    accuracy = correct / max(len(cache), 1) * 100
+    average_gens = gens / max(len(cache), 1)
+    bounds = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    z = special.ndtri((1 + confidence) / 2)
+
+    def mean_ci(values):
+        half_width = z * values.std(ddof = 1) / np.sqrt(len(values)) if len(values) > 1 else np.inf
+        return (values.mean() - half_width, values.mean() + half_width)
+
+    return {
+        'accuracy' : accuracy.mean(),
+        'accuracy_ci' : mean_ci(accuracy),
+        'accuracy_spread' : tuple(np.percentile(accuracy, bounds)),
+        'average_gens' : average_gens.mean(),
+        'average_gens_ci' : mean_ci(average_gens),
+        'average_gens_spread' : tuple(np.percentile(average_gens, bounds)),
+        'accuracy_per_permutation' : accuracy,
+        'average_gens_per_permutation' : average_gens,
+    }
+
+def write_sweep(rows, output_file = None):
+    '''
+    Prints the sweep results as a table, and writes them to a CSV file if given.
+    '''
+    print(f"{'Criteria':<14}{'Thresh':>10}{'Accuracy':>12}{'Average Gens':>15}")
+    for row in rows:
+        print(f"{row['stop_criteria']:<14}{row['stop_criteria_thresh']:>10.4g}{row['accuracy']:>11.2f}%{row['average_gens']:>15.2f}")
+    if output_file is not None:
+        with open(output_file, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
 
 if __name__ == '__main__':
 
     # Usage: python examples/eval_outputs.py --output_file examples/outputs/outputs.jsonl --stop_criteria beta --stop_criteria_thresh 0.95
+    # Permutations: python examples/eval_outputs.py --output_file examples/outputs/outputs.jsonl --stop_criteria beta --stop_criteria_thresh 0.95 --num_permutations 1000
+    # Sweep: python examples/eval_outputs.py --output_file examples/outputs/outputs.jsonl --sweep_criteria beta majority --sweep_thresholds 0.8 0.9 0.95 --sweep_output sweep.csv
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--output_file', type=str, required=True)
     parser.add_argument('--stop_criteria', type=str, default=None)
     parser.add_argument('--stop_criteria_thresh', type=float, required=False, default=None)
+    parser.add_argument('--futility', action='store_true', help='Also stop once the remaining samples can no longer meet the stop criteria')
+    parser.add_argument('--sweep_criteria', type=str, nargs='+', default=None, help='Stop criteria to sweep over (defaults to --stop_criteria)')
+    parser.add_argument('--sweep_thresholds', type=float, nargs='+', default=None, help='Thresholds to sweep over, evaluated in a single pass')
+    parser.add_argument('--sweep_output', type=str, default=None, help='CSV file for the sweep results')
+    parser.add_argument('--no_answer_cache', action='store_true', help='Parse the outputs file instead of using (and writing) its .answers.npz sidecar')
+    parser.add_argument('--num_permutations', type=int, default=None, help='Average over this many random orderings of the samples of each question')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for --num_permutations')
 
     args = parser.parse_args()
 
+    eval_as_str = answers_are_strings(args.output_file)
+
+    if args.no_answer_cache:
+        dt = read_jsonl(args.output_file, fields = ('answers', 'scores', 'target'))
+    else:
+        dt = load_answer_cache(args.output_file, eval_as_str)
+
+    if args.sweep_thresholds is not None:
+        criteria = {name : stop_criteria_dict[name]() for name in (args.sweep_criteria or [args.stop_criteria or 'beta'])}
+        rows = sweep(dt, criteria, args.sweep_thresholds, eval_as_str = eval_as_str, futility = args.futility)
+        write_sweep(rows, args.sweep_output)
+        exit(0)
+
     if args.stop_criteria is None:
         args.stop_criteria = 'always_false'
         print('No Stop Criteria Provided. Running Self-Consistency')
     if args.stop_criteria_thresh is None or args.stop_criteria_thresh == -1:
-        ac = AC(max_gens = 1000, stop_criteria=stop_criteria_dict[args.stop_criteria]())
+        ac = AC(max_gens = 1000, stop_criteria=stop_criteria_dict[args.stop_criteria](), futility = args.futility)
     else:
-        ac = AC(max_gens = 1000, stop_criteria=stop_criteria_dict[args.stop_criteria](conf_thresh = args.stop_criteria_thresh))
-    
-
-    dt = list(map(json.loads, open(args.output_file)))
+        ac = AC(max_gens = 1000, stop_criteria=stop_criteria_dict[args.stop_criteria](conf_thresh = args.stop_criteria_thresh), futility = args.futility)
 
-    eval_as_str = not ('gsm' in args.output_file or 'asdiv' in args.output_file or 'svamp' in args.output_file)
+    if args.num_permutations is not None:
+        if args.futility:
+            raise ValueError('--futility is not supported with --num_permutations')
+        if not isinstance(dt, AnswerCache):
+            dt = AnswerCache.from_records(dt, eval_as_str)
+        outp = permutation_replay(dt, ac.stop_criteria, args.num_permutations, seed = args.seed)
+        print(f"Accuracy: {outp['accuracy']:.2f}% (95% CI of the mean: {outp['accuracy_ci'][0]:.2f}-{outp['accuracy_ci'][1]:.2f}%, 95% spread over {args.num_permutations} orderings: {outp['accuracy_spread'][0]:.2f}-{outp['accuracy_spread'][1]:.2f}%)")
+        print(f"Average Gens: {outp['average_gens']:.2f} (95% CI of the mean: {outp['average_gens_ci'][0]:.2f}-{outp['average_gens_ci'][1]:.2f}, 95% spread over {args.num_permutations} orderings: {outp['average_gens_spread'][0]:.2f}-{outp['average_gens_spread'][1]:.2f})")
+        exit(0)
 
     correct_answers, total_answers, total_gens = main(dt, ac, eval_as_str = eval_as_str)
     print(f'Accuracy: {correct_answers}/{total_answers} ({correct_answers/total_answers*100:.2f}%)')
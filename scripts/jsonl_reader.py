@@ -0,0 +1,181 @@
+import json
+import os
+
+import numpy as np
+
+# Bump when the layout of the index sidecar changes, so that stale indices are rebuilt
+INDEX_VERSION = 2
+
+# Lines made only of these bytes are blank, and are neither indexed nor parsed
+WHITESPACE = b' \t\n\r\x0b\x0c'
+
+
+def index_path(path):
+    '''
+    Path of the line-offset index sidecar of a JSONL file.
+    '''
+    return os.path.splitext(path)[0] + '.idx.npz'
+
+def scan_offsets(path, start = 0, chunk_size = 1 << 24):
+    '''
+    Byte offsets of the non-blank lines of a file, starting the scan at byte `start` (which must begin a line).
+
+    A line is blank if it only holds whitespace, the same rule `JsonlReader.__iter__` uses to skip lines.
+    '''
+    offsets = []
+    whitespace = np.frombuffer(WHITESPACE, dtype = np.uint8)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        line_start = start
+        pos = start
+        # Whether the line that is still open at the end of the previous chunk has any non-whitespace byte
+        has_content = False
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype = np.uint8)
+            # content[i] is the number of non-whitespace bytes in chunk[:i]
+            content = np.concatenate([[0], np.cumsum(~np.isin(data, whitespace))])
+            ends = np.flatnonzero(data == ord('\n')) + pos
+            starts = np.concatenate([[line_start], ends[:-1] + 1]) if len(ends) else np.empty(0, dtype = np.int64)
+            keep = content[ends - pos] - content[np.maximum(starts - pos, 0)] > 0
+            if len(keep) and line_start < pos:
+                keep[0] |= has_content
+            offsets.append(starts[keep])
+            if len(ends):
+                line_start = int(ends[-1]) + 1
+                has_content = content[-1] - content[line_start - pos] > 0
+            else:
+                has_content = has_content or content[-1] > 0
+            pos += len(chunk)
+        if pos > line_start and has_content:
+            # Last line without a trailing newline
+            offsets.append(np.array([line_start]))
+    return np.concatenate(offsets).astype(np.int64) if offsets else np.empty(0, dtype = np.int64)
+
+
+class JsonlReader:
+    '''
+    Streams the records of a JSONL file, without loading the file into memory.
+
+    Records are parsed lazily, one line at a time, and can be projected to the fields a caller needs so that large
+    fields (e.g. the full `generation` history) are dropped right away. Slicing (`reader[start:stop]`) returns a view
+    that seeks straight to the first record, using a line-offset index. The index is saved next to the file, keyed by
+    its size and modification time, and extended in place when the file was only appended to.
+
+    Args:
+        path (str): The JSONL file.
+        fields (List[str]): Fields to keep in each record. All fields if None.
+        save_index (bool): Whether to save the line-offset index next to the file once built.
+    '''
+
+    def __init__(self, path, fields = None, save_index = True):
+        self.path = path
+        self.fields = list(fields) if fields is not None else None
+        self.save_index = save_index
+        self._offsets = None
+        self._start, self._stop = 0, None
+
+    @property
+    def offsets(self):
+        '''
+        Byte offset of each record, loaded from (or saved to) the index sidecar.
+        '''
+        if self._offsets is None:
+            self._offsets = self._load_index()
+        return self._offsets
+
+    def _load_index(self):
+        path, stat = index_path(self.path), os.stat(self.path)
+        offsets, end = None, 0
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    source = json.loads(str(data['source']))
+                    if source['version'] == INDEX_VERSION and source['size'] == stat.st_size and source['mtime_ns'] == stat.st_mtime_ns:
+                        return data['offsets']
+                    if source['version'] == INDEX_VERSION and source['size'] < stat.st_size:
+                        offsets, end = data['offsets'], source['size']
+            except (OSError, ValueError, KeyError):
+                offsets = None
+
+        if offsets is not None and end > 0:
+            # Only reuse the index if the file was appended to, i.e. the old end still closes a line
+            with open(self.path, 'rb') as f:
+                f.seek(end - 1)
+                if f.read(1) != b'\n':
+                    offsets, end = None, 0
+        if offsets is None:
+            offsets, end = np.empty(0, dtype = np.int64), 0
+        offsets = np.concatenate([offsets, scan_offsets(self.path, end)])
+
+        if self.save_index:
+            tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+            try:
+                np.savez(tmp_path, offsets = offsets, source = json.dumps({'version' : INDEX_VERSION, 'size' : stat.st_size, 'mtime_ns' : stat.st_mtime_ns}))
+                os.replace(tmp_path, path)
+            except OSError:
+                # Read-only directory, so the index is rebuilt on every run
+                pass
+        return offsets
+
+    def _bounds(self):
+        start, stop, _ = slice(self._start, self._stop).indices(len(self.offsets))
+        return start, max(start, stop)
+
+    def __len__(self):
+        start, stop = self._bounds()
+        return stop - start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('JsonlReader only supports contiguous slices')
+            start, stop = self._bounds()
+            view = JsonlReader(self.path, self.fields, self.save_index)
+            view._offsets = self.offsets
+            sub = range(start, stop)[index]
+            view._start, view._stop = sub.start, sub.stop
+            return view
+        start, stop = self._bounds()
+        if index < 0:
+            index += stop - start
+        if not 0 <= index < stop - start:
+            raise IndexError('JsonlReader index out of range')
+        return next(iter(self[index:index + 1]))
+
+    def _project(self, record):
+        if self.fields is None:
+            return record
+        return {k : record[k] for k in self.fields if k in record}
+
+    def __iter__(self):
+        if self._start == 0 and self._stop is None and self._offsets is None:
+            # Plain sequential read, no index needed
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip(WHITESPACE.decode()):
+                        yield self._project(json.loads(line))
+            return
+
+        start, stop = self._bounds()
+        if start >= stop:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(int(self.offsets[start]))
+            remaining = stop - start
+            for line in f:
+                if not line.strip(WHITESPACE):
+                    continue
+                yield self._project(json.loads(line))
+                remaining -= 1
+                if remaining == 0:
+                    break
+
+
+def read_jsonl(path, fields = None):
+    '''
+    Reads all records of a JSONL file into a list, keeping only the given fields.
+    '''
+    return list(JsonlReader(path, fields))
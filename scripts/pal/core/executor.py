@@ -0,0 +1,234 @@
+import io
+import marshal
+import multiprocessing
+import queue
+import threading
+import time
+from contextlib import redirect_stdout
+from multiprocessing.connection import wait
+from types import CodeType
+from typing import Any, List, Optional, Sequence, Union
+
+
+class WorkerDiedError(RuntimeError):
+    '''
+    Raised (returned) for a program whose worker process died while executing it.
+    '''
+
+
+def run_program(runtime, code : Union[List[str], CodeType], answer_symbol : Optional[str] = None, answer_expr : Optional[str] = None, get_answer_from_stdout : bool = False) -> Any:
+    '''
+    Executes a program (a list of lines) in a runtime and returns its answer, as `ProgramInterface.execute` does.
+
+    The program can also be a precompiled code object, unless the answer is the value of its last line.
+    '''
+    source = code if isinstance(code, CodeType) else '\n'.join(code)
+    if get_answer_from_stdout:
+        program_io = io.StringIO()
+        with redirect_stdout(program_io):
+            runtime.exec_code(source)
+        program_io.seek(0)
+        return program_io.readlines()[-1]
+    elif answer_symbol:
+        runtime.exec_code(source)
+        return runtime._global_vars[answer_symbol]
+    elif answer_expr:
+        runtime.exec_code(source)
+        return runtime.eval_code(answer_expr)
+    else:
+        if isinstance(code, CodeType):
+            raise ValueError('A code object has no last line to evaluate. Set an answer symbol or expression')
+        runtime.exec_code('\n'.join(code[:-1]))
+        return runtime.eval_code(code[-1])
+
+
+def _worker_loop(conn) -> None:
+    # One runtime per runtime class, reset before every program as ProgramInterface.reinit does
+    runtimes = {}
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, OSError):
+            break
+        if task is None:
+            break
+        (runtime_cls, snapshot), code, answer_symbol, answer_expr, get_answer_from_stdout = task
+        if isinstance(code, bytes):
+            # A precompiled code object, sent marshalled since code objects cannot be pickled
+            code = marshal.loads(code)
+        if (runtime_cls, snapshot) not in runtimes:
+            runtimes[runtime_cls, snapshot] = runtime_cls(snapshot = snapshot)
+        runtime = runtimes[runtime_cls, snapshot]
+        runtime.reset()
+        try:
+            outp = (True, run_program(runtime, code, answer_symbol, answer_expr, get_answer_from_stdout))
+        except BaseException as e:
+            # Includes SystemExit from generated code calling exit(), which must not take the worker down
+            outp = (False, e if isinstance(e, Exception) else RuntimeError(repr(e)))
+        try:
+            conn.send(outp)
+        except Exception as e:
+            # The answer (or exception) could not be pickled
+            conn.send((False, RuntimeError(f'Could not send the program result: {e!r}')))
+
+
+class _Worker:
+
+    def __init__(self, ctx) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target = _worker_loop, args = (child_conn,), daemon = True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout = 1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ProgramExecutor:
+    '''
+    A pool of warm worker processes that execute generated programs in parallel, with a wall-clock limit per program.
+
+    Unlike the SIGALRM based `timeout`, this works from any thread (or an asyncio executor), and also stops programs that
+    hang in C code: a worker that runs past its limit is killed and replaced by a fresh one. All workers are started when
+    the pool is created, so create it on the main thread before starting any other threads: with the default 'fork'
+    start method, a process forked while another thread holds a lock can hang. Replacements are forked from the calling
+    thread, and in the rare case that one hangs, it is caught and replaced again by the next timeout. Each worker keeps
+    one runtime per runtime class, reset before every program. Variables injected into a runtime instance
+    are not carried over to the workers, only its class is.
+
+    The pool can be shared by several interfaces and called concurrently from several threads, in which case the callers
+    share the workers.
+
+    Args:
+        num_workers (int): Number of worker processes. Defaults to the number of CPUs.
+        timeout (float): Default wall-clock limit per program, in seconds.
+        start_method (str): multiprocessing start method. Defaults to 'fork' where available, since 'spawn' re-imports
+            the main script in every worker.
+    '''
+
+    def __init__(self, num_workers : Optional[int] = None, timeout : float = 2., start_method : Optional[str] = None) -> None:
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        if start_method is None:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._ctx = multiprocessing.get_context(start_method)
+        self._lock = threading.Lock()
+        self._workers = set()
+        # Free slots, holding either an idle worker or None for a worker that was discarded and is not replaced yet
+        self._idle = queue.Queue()
+        for _ in range(self.num_workers):
+            worker = _Worker(self._ctx)
+            self._workers.add(worker)
+            self._idle.put(worker)
+        self._closed = False
+
+    def _acquire(self, block : bool) -> Optional[_Worker]:
+        worker = self._idle.get(block = block)
+        if worker is None or not worker.process.is_alive():
+            if worker is not None:
+                self._discard(worker)
+            worker = _Worker(self._ctx)
+            with self._lock:
+                self._workers.add(worker)
+        return worker
+
+    def _release(self, worker : _Worker) -> None:
+        self._idle.put(worker)
+
+    def _discard(self, worker : _Worker) -> None:
+        worker.kill()
+        with self._lock:
+            self._workers.discard(worker)
+
+    def map(self, runtime_cls : type, programs : Sequence[Union[List[str], CodeType]], answer_symbol : Optional[str] = None, answer_expr : Optional[str] = None, get_answer_from_stdout : bool = False, timeout : Optional[float] = None, snapshot : bool = False) -> List[Any]:
+        '''
+        Executes programs (each a list of lines) in parallel, each in a freshly reset `runtime_cls` runtime, created in
+        snapshot mode if `snapshot` is set. Programs can also be precompiled code objects, as with `run_program`; they are
+        sent to the workers marshalled, which the workers share the Python version for.
+
+        Returns:
+            List[Any]: The answer of each program, in order. Programs that raised, timed out or crashed their worker get
+            the exception instead (a TimeoutError on timeouts), as with `asyncio.gather(..., return_exceptions=True)`.
+        '''
+        if self._closed:
+            raise RuntimeError('ProgramExecutor is closed')
+        timeout = self.timeout if timeout is None else timeout
+        results = [None] * len(programs)
+        pending = list(range(len(programs)))[::-1]
+        busy = {}
+
+        while pending or busy:
+            # Take as many free workers as there are pending programs, blocking only when nothing is running
+            while pending:
+                try:
+                    worker = self._acquire(block = not busy)
+                except queue.Empty:
+                    break
+                idx = pending.pop()
+                try:
+                    code = programs[idx]
+                    code = marshal.dumps(code) if isinstance(code, CodeType) else list(code)
+                    worker.conn.send(((runtime_cls, snapshot), code, answer_symbol, answer_expr, get_answer_from_stdout))
+                except Exception as e:
+                    results[idx] = e
+                    self._discard(worker)
+                    self._idle.put(None)
+                    continue
+                busy[worker.conn] = (worker, idx, time.monotonic() + timeout)
+
+            if not busy:
+                continue
+            wait_time = max(0., min(deadline for _, _, deadline in busy.values()) - time.monotonic())
+            if pending:
+                # Check back soon for workers freed by other callers
+                wait_time = min(wait_time, 0.01)
+            for conn in wait(list(busy), timeout = wait_time):
+                worker, idx, _ = busy.pop(conn)
+                try:
+                    # Failed programs send their exception as the value
+                    _, value = conn.recv()
+                except (EOFError, OSError):
+                    results[idx] = WorkerDiedError('The worker process died while executing the program')
+                    self._discard(worker)
+                    self._idle.put(None)
+                    continue
+                results[idx] = value
+                self._release(worker)
+
+            now = time.monotonic()
+            for conn, (worker, idx, deadline) in list(busy.items()):
+                if now >= deadline:
+                    del busy[conn]
+                    results[idx] = TimeoutError(f'Program timed out after {timeout}s')
+                    self._discard(worker)
+                    self._idle.put(None)
+        return results
+
+    def close(self) -> None:
+        '''
+        Stops all worker processes.
+        '''
+        self._closed = True
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            worker.close()
+
+    def __enter__(self) -> 'ProgramExecutor':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -12,30 +12,91 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import io
+import ast
+import hashlib
+import marshal
 import signal
-from contextlib import redirect_stdout
-from typing import Any, Callable, List, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType
+from typing import Any, Callable, List, Optional, Union
 from collections import Counter
 
 from .runtime import GenericRuntime
+from .executor import ProgramExecutor, WorkerDiedError, run_program
 from .backend import call_gpt
 from .vicuna import call_vicuna
 
-from adaptive_consistency import AC, stop_criteria_dict
+from adaptive_consistency import AC, LRUCache, stop_criteria_dict
 
 
 
-def init_adaptive_consistency(max_gens, stop_criteria, stop_criteria_thresh):
+# Caps the number of backend requests in flight across all interfaces and threads. See limit_backend_requests
+_backend_slots = None
+
+
+def limit_backend_requests(max_inflight: Optional[int]):
+    '''
+    Limits the number of concurrent backend requests, shared by every interface in the process. None for no limit.
+    '''
+    global _backend_slots
+    _backend_slots = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+
+
+def backend_call(*args, **kwargs):
+    slots = _backend_slots
+    if slots is None:
+        return call_gpt(*args, **kwargs)
+    with slots:
+        return call_gpt(*args, **kwargs)
+
+
+def init_adaptive_consistency(max_gens, stop_criteria, stop_criteria_thresh, futility = False):
     if stop_criteria is None:
         stop_criteria = 'always_false'
     if stop_criteria_thresh is None or stop_criteria_thresh == -1:
-        ac = AC(max_gens = max_gens, stop_criteria=stop_criteria_dict[stop_criteria]())
+        ac = AC(max_gens = max_gens, stop_criteria=stop_criteria_dict[stop_criteria](), futility = futility)
     else:
-        ac = AC(max_gens = max_gens, stop_criteria=stop_criteria_dict[stop_criteria](conf_thresh = stop_criteria_thresh))
+        ac = AC(max_gens = max_gens, stop_criteria=stop_criteria_dict[stop_criteria](conf_thresh = stop_criteria_thresh), futility = futility)
     return ac
 
 
+def next_step_size(step_size, session, num_gens, max_gens):
+    # With step_size == 'auto', request exactly as many samples as could end the run if they all agree with the
+    # current majority. If no such number exists within the budget, every remaining sample will be drawn anyway.
+    remaining = max_gens - num_gens
+    if step_size != 'auto':
+        return min(step_size, remaining)
+    num_additional = session.min_additional_to_stop()
+    if num_additional is None:
+        return remaining
+    return max(1, min(num_additional, remaining))
+
+
+def normalize_program(code: Union[List[str], CodeType], split_last: bool = False) -> str:
+    '''
+    Hash of a program that ignores whitespace and comments, from its AST dump. With split_last, the last line is hashed
+    separately, since it is evaluated on its own. Programs that do not parse are hashed as written, and precompiled code
+    objects by their marshalled bytes.
+    '''
+    if isinstance(code, CodeType):
+        # Version 2 has no back-references, whose use depends on reference counts and so changes once the code has run
+        return hashlib.sha1(b'code:' + marshal.dumps(code, 2)).hexdigest()
+    parts = [code[:-1], code[-1:]] if split_last else [code]
+    dumps = []
+    for part in parts:
+        source = '\n'.join(part)
+        try:
+            dumps.append(ast.dump(ast.parse(source)))
+        except (SyntaxError, ValueError):
+            dumps.append('unparsed:' + source)
+    return hashlib.sha1('\0'.join(dumps).encode()).hexdigest()
+
+
+# Failures that depend on load rather than on the program, which the execution cache does not store
+TRANSIENT_ERRORS = (TimeoutError, WorkerDiedError)
+
+
 class timeout:
     def __init__(self, seconds=1, error_message='Timeout'):
         self.seconds = seconds
@@ -61,9 +122,12 @@ class TextInterface:
         openai_url: Optional[str] = None,
         stop_criteria: Optional[str] = None,
         stop_criteria_thresh: Optional[float] = None,
+        futility: bool = False,
     ):
         self.max_gens = max_gens
-        self.ac = init_adaptive_consistency(self.max_gens, stop_criteria, stop_criteria_thresh)
+        self.ac = init_adaptive_consistency(self.max_gens, stop_criteria, stop_criteria_thresh, futility)
+        # Whether the last adaptive run stopped because the remaining budget could no longer meet the stop criteria
+        self.exhausted = False
 
         self.history = []
         self.answer_prefix = answer_prefix
@@ -104,10 +168,10 @@ class TextInterface:
         # gen = call_gpt(prompt, model=self.model, stop=self.stop, 
             # temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at)
         if logprobs != 0:
-            gens, dt = call_gpt(prompt, model=self.model, stop=self.stop, 
+            gens, dt = backend_call(prompt, model=self.model, stop=self.stop, 
                     temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at, logprobs=logprobs)   
         else:
-            gens = call_gpt(prompt, model=self.model, stop=self.stop, 
+            gens = backend_call(prompt, model=self.model, stop=self.stop, 
                 temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at, )
             
         if logprobs != 0:
@@ -135,10 +199,15 @@ class ProgramInterface:
         openai_url: Optional[str] = None,
         stop_criteria: Optional[str] = None,
         stop_criteria_thresh: Optional[float] = None,
+        futility: bool = False,
+        executor: Optional[ProgramExecutor] = None,
+        execution_cache: Union[bool, LRUCache] = False,
     ) -> None:
 
         self.max_gens = max_gens
-        self.ac = init_adaptive_consistency(self.max_gens, stop_criteria, stop_criteria_thresh)
+        self.ac = init_adaptive_consistency(self.max_gens, stop_criteria, stop_criteria_thresh, futility)
+        # Whether the last adaptive run stopped because the remaining budget could no longer meet the stop criteria
+        self.exhausted = False
 
         self.model = model
         self.runtime = runtime if runtime else GenericRuntime()
@@ -148,13 +217,19 @@ class ProgramInterface:
         self.answer_expr = get_answer_expr
         self.get_answer_from_stdout = get_answer_from_stdout
         self.verbose = verbose
+        # When set, programs run in its worker processes instead of in-process under SIGALRM
+        self.executor = executor
+        # Results (answers or raised exceptions, but not timeouts or worker crashes) of executed programs, keyed by
+        # execution_key. Pass an LRUCache to share it
+        if execution_cache is True:
+            execution_cache = LRUCache()
+        self.execution_cache = execution_cache if isinstance(execution_cache, LRUCache) else None
 
         if openai_url is not None:
             globals()['call_gpt'] = lambda *args, **kwargs : call_vicuna(*args, **kwargs, url=openai_url)
 
     def reinit(self):
-        import copy
-        self.runtime._global_vars = copy.copy(self.runtime.GLOBAL_DICT) 
+        self.runtime.reset()
 
     
     def clear_history(self):
@@ -166,10 +241,10 @@ class ProgramInterface:
     def generate(self, prompt: str, temperature: float =0.0, top_p: float =1.0, 
             max_tokens: int =512, majority_at: int = None, logprobs = 0):
         if logprobs != 0:
-            gens, dt = call_gpt(prompt, model=self.model, stop=self.stop, 
+            gens, dt = backend_call(prompt, model=self.model, stop=self.stop, 
                 temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at, logprobs=logprobs)   
         else:
-            gens = call_gpt(prompt, model=self.model, stop=self.stop, 
+            gens = backend_call(prompt, model=self.model, stop=self.stop, 
                 temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at, )
         if self.verbose:
             print(gens)
@@ -180,42 +255,86 @@ class ProgramInterface:
             self.history.append(gens)
         return code
     
-    def execute(self, code: Optional[List[str]] = None, TIMEOUT = 2):
-        # from pdb import set_trace
-        # set_trace()
-        with timeout(TIMEOUT):
-            code = code if code else self.code
-            if self.get_answer_from_stdout:
-                program_io = io.StringIO()
-                with redirect_stdout(program_io):
-                    self.runtime.exec_code('\n'.join(code))
-                program_io.seek(0)
-                return program_io.readlines()[-1]
-            elif self.answer_symbol:
-                self.runtime.exec_code('\n'.join(code))
-                return self.runtime._global_vars[self.answer_symbol]
-            elif self.answer_expr:
-                self.runtime.exec_code('\n'.join(code))
-                return self.runtime.eval_code(self.answer_expr)
-            else:
-                self.runtime.exec_code('\n'.join(code[:-1]))
-                return self.runtime.eval_code(code[-1])
-        return ""
+    def execution_key(self, code: Union[List[str], CodeType]):
+        split_last = not (self.get_answer_from_stdout or self.answer_symbol or self.answer_expr)
+        return (type(self.runtime), self.answer_symbol, self.answer_expr, self.get_answer_from_stdout, normalize_program(code, split_last))
+
+    def execute(self, code: Optional[Union[List[str], CodeType]] = None, TIMEOUT = 2):
+        # Programs are lists of lines, or precompiled code objects when the answer comes from a symbol, an expression
+        # or stdout (see run_program)
+        code = code if code is not None else self.code
+        if self.execution_cache is None:
+            with timeout(TIMEOUT):
+                return run_program(self.runtime, code, self.answer_symbol, self.answer_expr, self.get_answer_from_stdout)
+            return ""
+
+        # Duplicate programs, up to whitespace and comments, reuse the first one's answer or exception
+        key = self.execution_key(code)
+        outp = self.execution_cache.get(key)
+        if outp is None:
+            try:
+                with timeout(TIMEOUT):
+                    outp = (True, run_program(self.runtime, code, self.answer_symbol, self.answer_expr, self.get_answer_from_stdout))
+            except Exception as e:
+                outp = (False, e)
+            if not isinstance(outp[1], TRANSIENT_ERRORS):
+                self.execution_cache.put(key, outp)
+        ok, value = outp
+        if not ok:
+            raise value.with_traceback(None)
+        return value
+
+    def execute_batch(self, code_snippets: List[Union[List[str], CodeType]], time_out: Optional[float] = None, prepend_to_code = ""):
+        '''
+        Executes a batch of programs, in parallel if an executor is set. Returns the answer of each program, or the
+        exception it raised.
+
+        time_out is the wall-clock limit per program. If None, the executor's own timeout applies, or 10s in-process.
+
+        Programs can also be precompiled code objects, as with execute. prepend_to_code is only added to the programs
+        given as lines.
+        '''
+        programs = [code if isinstance(code, CodeType) else prepend_to_code.splitlines() + code for code in code_snippets]
+        if self.executor is not None and self.execution_cache is None:
+            return self.executor.map(type(self.runtime), programs, self.answer_symbol, self.answer_expr, self.get_answer_from_stdout, timeout=time_out, snapshot=self.runtime.snapshot)
+        if self.executor is not None:
+            # Only send the distinct programs that are not cached yet
+            results = [None] * len(programs)
+            misses = {}
+            for i, code in enumerate(programs):
+                key = self.execution_key(code)
+                outp = self.execution_cache.get(key)
+                if outp is None:
+                    misses.setdefault(key, []).append(i)
+                else:
+                    results[i] = outp[1]
+            values = self.executor.map(type(self.runtime), [programs[idxs[0]] for idxs in misses.values()], self.answer_symbol, self.answer_expr, self.get_answer_from_stdout, timeout=time_out, snapshot=self.runtime.snapshot)
+            for (key, idxs), value in zip(misses.items(), values):
+                if not isinstance(value, TRANSIENT_ERRORS):
+                    self.execution_cache.put(key, (not isinstance(value, Exception), value))
+                for i in idxs:
+                    results[i] = value
+            return results
+        results = []
+        for code in programs:
+            self.reinit()
+            with timeout(10 if time_out is None else time_out):
+                try:
+                    results.append(self.execute(code))
+                except Exception as e:
+                    results.append(e)
+        return results
     
-    def run(self, prompt: str, time_out: float =10, temperature: float =0.0, top_p: float =1.0, 
+    def run(self, prompt: str, time_out: Optional[float] = None, temperature: float =0.0, top_p: float =1.0, 
             max_tokens: int =512, majority_at: int = None, prepend_to_code = "", logprobs = 0):
         code_snippets = self.generate(prompt, majority_at=majority_at, temperature=temperature, top_p=top_p, max_tokens=max_tokens, logprobs = logprobs)
         # print(code_snippets)
         results = []
-        for code in code_snippets:
-            self.reinit()
-            with timeout(time_out):
-                try:
-                    exec_result = self.execute(prepend_to_code.splitlines() + code)
-                except Exception as e:
-                    print(e)
-                    continue
-                results.append(exec_result)
+        for exec_result in self.execute_batch(code_snippets, time_out, prepend_to_code):
+            if isinstance(exec_result, Exception):
+                print(exec_result)
+                continue
+            results.append(exec_result)
         counter = Counter(results)
         return counter.most_common(1)[0][0]
 
@@ -223,60 +342,100 @@ class ProgramInterface:
 
 class AdaptiveProgramInterface(ProgramInterface):
 
-    def __init__(self, answer_type = 'float', step_size = 1,  *args, **kwargs):
+    def __init__(self, answer_type = 'float', step_size = 1, pipeline = False, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
         self.answer_type = answer_type
         self.step_size = step_size
+        # Whether to send the next generation request while the current batch of programs is executed and checked
+        self.pipeline = pipeline
+        # Number of generations requested by the last run, but discarded because it stopped first
+        self.discarded_gens = 0
 
-    def generate(self, prompt: str, temperature: float =0.0, top_p: float =1.0, 
-            max_tokens: int =512, majority_at: int =None, logprobs = 0):
-        self.history.append([])
-        gens = call_gpt(prompt, model=self.model, stop=self.stop, 
+    def request(self, prompt: str, temperature: float =0.0, top_p: float =1.0, 
+            max_tokens: int =512, majority_at: int =None):
+        # Does not touch the history, so that it can run in a background thread
+        gens = backend_call(prompt, model=self.model, stop=self.stop, 
             temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at, )
         if self.verbose:
             print(gens)
-        gens = [x.strip() for x in gens]
-        # print('Processing generations to code')
-        code = self.process_generation_to_code(gens)
-        # print('Appending to code')
-        self.history[-1].extend(gens)
-        return code
+        return [x.strip() for x in gens]
 
-    def run(self, prompt: str, time_out: float =10, temperature: float =0.0, top_p: float =1.0, 
+    def record(self, gens: List[str]):
+        self.history.append(list(gens))
+        return self.process_generation_to_code(gens)
+
+    def generate(self, prompt: str, temperature: float =0.0, top_p: float =1.0, 
+            max_tokens: int =512, majority_at: int =None, logprobs = 0):
+        return self.record(self.request(prompt, temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=majority_at))
+
+    def run(self, prompt: str, time_out: Optional[float] = None, temperature: float =0.0, top_p: float =1.0, 
             max_tokens: int =512, majority_at: int =None, prepend_to_code = ""):
         all_results = []
-        for i in range(0, self.max_gens, self.step_size):
-            code_snippets = self.generate(prompt, majority_at=self.step_size, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
-            
-            results = []
-            for code in code_snippets:
-                self.reinit()
-                with timeout(time_out):
-                    try:
-                        exec_result = self.execute(prepend_to_code.splitlines() + code)
-                        if self.answer_type == 'float':
-                            exec_result = float(exec_result)
-                        else:
-                            exec_result = str(exec_result)
-                    except Exception as e:
-                        print('Eror', e)
-                        # traceback.print_exc()
-
-                        continue
-                    results.append(exec_result)
-            all_results += results
-            # print(all_results)
-            if len(all_results) == 0:
+        session = self.ac.session()
+        num_gens = 0
+        self.exhausted = False
+        pool = ThreadPoolExecutor(max_workers=1) if self.pipeline else None
+        # (step size, future) of the generation request in flight, in pipelined mode
+        pending = None
+        try:
+            while num_gens < self.max_gens:
+                if pending is not None:
+                    step_size, gens = pending[0], pending[1].result()
+                    pending = None
+                else:
+                    step_size = next_step_size(self.step_size, session, num_gens, self.max_gens)
+                    gens = self.request(prompt, majority_at=step_size, temperature=temperature, top_p=top_p, max_tokens=max_tokens)
+                code_snippets = self.record(gens)
+                num_gens += step_size
+                if pool is not None and num_gens < self.max_gens:
+                    # Sized from the answers so far, since the current batch has not been executed yet
+                    next_size = next_step_size(self.step_size, session, num_gens, self.max_gens)
+                    pending = (next_size, pool.submit(self.request, prompt, majority_at=next_size, temperature=temperature, top_p=top_p, max_tokens=max_tokens))
+
+                if self._consume(session, all_results, code_snippets, time_out, prepend_to_code, num_gens):
+                    break
+        finally:
+            # A request still in flight is cancelled if it has not started, and its result discarded otherwise
+            self.discarded_gens = pending[0] if pending is not None else 0
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        print('Used {} generations'.format(num_gens))
+        if len(all_results) == 0:
+            raise ValueError('No valid answers were generated')
+        return session.most_common, all_results
+
+    def _consume(self, session, all_results, code_snippets, time_out, prepend_to_code, num_gens):
+        '''
+        Executes a batch of programs and adds their answers to the session. Returns whether to stop.
+        '''
+        results = []
+        for exec_result in self.execute_batch(code_snippets, time_out, prepend_to_code):
+            try:
+                if isinstance(exec_result, Exception):
+                    raise exec_result
+                if self.answer_type == 'float':
+                    exec_result = float(exec_result)
+                else:
+                    exec_result = str(exec_result)
+            except Exception as e:
+                print('Eror', e)
+                # traceback.print_exc()
+
                 continue
-            # if has_conclusive_majority_binomial_prob(all_results, self.conf_thresh)[1]:
-            if self.ac.should_stop(all_results):
-                # print('Less goo!', results)
-                break
-        print('Used {} generations'.format(i+4))
-        counter = Counter(all_results)
-        most_common = counter.most_common(1)[0]
-        return most_common[0], all_results
+            results.append(exec_result)
+        all_results += results
+        session.extend(results)
+        # print(all_results)
+        if len(all_results) == 0:
+            return False
+        # if has_conclusive_majority_binomial_prob(all_results, self.conf_thresh)[1]:
+        outp = session.should_stop(return_dict=True, remaining=self.max_gens - num_gens)
+        if outp['stop']:
+            # print('Less goo!', results)
+            self.exhausted = outp['exhausted']
+            return True
+        return False
     
 
 class AdaptiveTextInterface(TextInterface):
@@ -289,11 +448,16 @@ class AdaptiveTextInterface(TextInterface):
     def run(self, prompt: str, time_out: float =10, temperature: float =0.0, top_p: float =1.0, 
             max_tokens: int =512, majority_at: int =None, prepend_to_code = ""):
         all_results = []
-        for i in range(0, self.max_gens, self.step_size):
-            print(i)
-            gens = call_gpt(prompt, model=self.model, stop=self.stop, 
-                    temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=self.step_size, )
-            print(i)
+        session = self.ac.session()
+        num_gens = 0
+        self.exhausted = False
+        while num_gens < self.max_gens:
+            step_size = next_step_size(self.step_size, session, num_gens, self.max_gens)
+            print(num_gens)
+            gens = backend_call(prompt, model=self.model, stop=self.stop, 
+                    temperature=temperature, top_p=top_p, max_tokens=max_tokens, majority_at=step_size, )
+            num_gens += step_size
+            print(num_gens)
             results = []
             for gen in gens:
                 self.reinit()
@@ -301,12 +465,15 @@ class AdaptiveTextInterface(TextInterface):
                 ans = self.extract_answer(gen)
                 results.append(ans)
             all_results += results
+            session.extend(results)
             if len(all_results) == 0:
                 continue
             # if has_conclusive_majority_binomial_prob(all_results, self.conf_thresh)[1]:
-            if self.ac.should_stop(all_results):
+            outp = session.should_stop(return_dict=True, remaining=self.max_gens - num_gens)
+            if outp['stop']:
+                self.exhausted = outp['exhausted']
                 break
-        print('Used {} generations'.format(i+4))
-        counter = Counter(all_results)
-        most_common = counter.most_common(1)[0]
-        return most_common[0], all_results
\ No newline at end of file
+        print('Used {} generations'.format(num_gens))
+        if len(all_results) == 0:
+            raise ValueError('No valid answers were generated')
+        return session.most_common, all_results
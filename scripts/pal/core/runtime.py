@@ -13,27 +13,65 @@
 # limitations under the License.
 
 
+import builtins
 import copy
 import datetime
-from typing import Any, Dict
+import functools
+from types import CodeType
+from typing import Any, Dict, Union
 import dateutil.relativedelta
 
 
+@functools.lru_cache(maxsize=1024)
+def compile_cached(source: str, mode: str = 'exec') -> CodeType:
+    # For code that runs over and over, like headers and answer expressions
+    return compile(source, '<string>', mode)
+
+
 class GenericRuntime:
     GLOBAL_DICT = {}
     LOCAL_DICT = None
     HEADERS = []
-    def __init__(self):
+    def __init__(self, snapshot: bool = False):
+        # With snapshot, the headers are compiled and executed once per runtime class, and reset() restores a shallow
+        # copy of the resulting globals instead of starting over. Functions defined by the headers keep the snapshot
+        # as their globals.
+        self.snapshot = snapshot
+        if snapshot:
+            self._snapshot = self.headers_snapshot()
+            self._global_vars = dict(self._snapshot)
+            self._local_vars = copy.copy(self.LOCAL_DICT) if self.LOCAL_DICT else None
+            return
+
         self._global_vars = copy.copy(self.GLOBAL_DICT)
         self._local_vars = copy.copy(self.LOCAL_DICT) if self.LOCAL_DICT else None
         
         for c in self.HEADERS:
             self.exec_code(c)
+
+    @classmethod
+    def headers_snapshot(cls) -> Dict[str, Any]:
+        if '_HEADERS_SNAPSHOT' not in cls.__dict__:
+            global_vars = copy.copy(cls.GLOBAL_DICT)
+            # exec would otherwise insert it into every fresh copy
+            global_vars['__builtins__'] = builtins
+            for c in cls.HEADERS:
+                exec(compile_cached(c), global_vars)
+            cls._HEADERS_SNAPSHOT = global_vars
+        return cls._HEADERS_SNAPSHOT
+
+    def reset(self) -> None:
+        if self.snapshot:
+            self._global_vars = dict(self._snapshot)
+        else:
+            self._global_vars = copy.copy(self.GLOBAL_DICT)
         
-    def exec_code(self, code_piece: str) -> None:
+    def exec_code(self, code_piece: Union[str, CodeType]) -> None:
         exec(code_piece, self._global_vars)
         
-    def eval_code(self, expr: str) -> Any:
+    def eval_code(self, expr: Union[str, CodeType]) -> Any:
+        if self.snapshot and isinstance(expr, str):
+            expr = compile_cached(expr, 'eval')
         return eval(expr, self._global_vars)
     
     def inject(self, var_dict: Dict[str, Any]) -> None:
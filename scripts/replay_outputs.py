@@ -0,0 +1,120 @@
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+from adaptive_consistency import stop_criteria_dict
+from answer_cache import AnswerCache, answers_are_strings, cache_path, load_answer_cache
+from eval_outputs import sweep
+from jsonl_reader import JsonlReader
+
+
+def find_output_files(root):
+    '''
+    Finds every outputs file (`*.jsonl`) under root, e.g. `outputs/<model>/<dataset>/*.jsonl`.
+    '''
+    if os.path.isfile(root):
+        return [root]
+    return sorted(glob.glob(os.path.join(root, '**', '*.jsonl'), recursive = True))
+
+def prepare_file(output_file, use_cache = True):
+    '''
+    Builds the answer cache of an outputs file if needed, and returns its number of records. Runs in a worker process.
+    '''
+    if use_cache:
+        return len(load_answer_cache(output_file))
+    return len(JsonlReader(output_file))
+
+def make_shards(num_records, shard_size):
+    '''
+    Splits each outputs file into record ranges of at most shard_size records.
+    '''
+    shards = []
+    for output_file, count in num_records.items():
+        for start in range(0, max(count, 1), shard_size):
+            shards.append((output_file, start, min(start + shard_size, count)))
+    return shards
+
+def replay_shard(output_file, start, stop, stop_criteria, conf_threshs, max_gens, futility, use_cache = True):
+    '''
+    Replays the records [start, stop) of an outputs file. Runs in a worker process.
+    '''
+    eval_as_str = answers_are_strings(output_file)
+    cache = AnswerCache.load(cache_path(output_file), output_file, eval_as_str) if use_cache else None
+    if cache is not None:
+        dt = cache[start:stop]
+    else:
+        dt = list(JsonlReader(output_file, fields = ('answers', 'scores', 'target'))[start:stop])
+    criteria = {name : stop_criteria_dict[name]() for name in stop_criteria}
+    return sweep(dt, criteria, conf_threshs, max_gens = max_gens, eval_as_str = eval_as_str, futility = futility, progress = False)
+
+def merge_rows(results):
+    '''
+    Sums the per-shard metrics of each (file, criteria, threshold) setting.
+    '''
+    merged = {}
+    for output_file, rows in results:
+        for row in rows:
+            key = (output_file, row['stop_criteria'], row['stop_criteria_thresh'])
+            if key not in merged:
+                merged[key] = {'output_file' : output_file, 'stop_criteria' : row['stop_criteria'], 'stop_criteria_thresh' : row['stop_criteria_thresh'], 'correct' : 0, 'total' : 0, 'total_gens' : 0}
+            for k in ('correct', 'total', 'total_gens'):
+                merged[key][k] += row[k]
+
+    report = []
+    for key in sorted(merged):
+        row = merged[key]
+        row['accuracy'] = row['correct'] / max(row['total'], 1) * 100
+        row['average_gens'] = row['total_gens'] / max(row['total'], 1)
+        report.append(row)
+    return report
+
+if __name__ == '__main__':
+
+    # Usage: python scripts/replay_outputs.py --root outputs/ --stop_criteria beta majority --stop_criteria_thresh 0.8 0.95 --output_file report.csv
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, required=True, help='Directory to search for outputs files (or a single file)')
+    parser.add_argument('--stop_criteria', type=str, nargs='+', default=['beta'])
+    parser.add_argument('--stop_criteria_thresh', type=float, nargs='+', default=[0.95])
+    parser.add_argument('--max_gens', type=int, default=40)
+    parser.add_argument('--futility', action='store_true', help='Also stop once the remaining samples can no longer meet the stop criteria')
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--shard_size', type=int, default=500, help='Maximum number of records replayed by a single task')
+    parser.add_argument('--output_file', type=str, default=None, help='CSV file for the merged report')
+    parser.add_argument('--no_answer_cache', action='store_true', help='Parse the outputs files instead of using (and writing) their .answers.npz sidecars')
+
+    args = parser.parse_args()
+
+    output_files = find_output_files(args.root)
+    if not output_files:
+        raise ValueError(f"No outputs files found under {args.root}")
+
+    start = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers = args.num_workers) as executor:
+        use_cache = not args.no_answer_cache
+        num_records = dict(zip(output_files, executor.map(prepare_file, output_files, [use_cache] * len(output_files))))
+        shards = make_shards(num_records, args.shard_size)
+        futures = {
+            executor.submit(replay_shard, output_file, lo, hi, args.stop_criteria, args.stop_criteria_thresh, args.max_gens, args.futility, use_cache) : output_file
+            for output_file, lo, hi in shards
+        }
+        for future in tqdm(as_completed(futures), total = len(futures)):
+            results.append((futures[future], future.result()))
+
+    report = merge_rows(results)
+    print(f"{'File':<60}{'Criteria':<14}{'Thresh':>10}{'Accuracy':>12}{'Average Gens':>15}")
+    for row in report:
+        print(f"{os.path.relpath(row['output_file'], args.root) if os.path.isdir(args.root) else row['output_file']:<60}{row['stop_criteria']:<14}{row['stop_criteria_thresh']:>10.4g}{row['accuracy']:>11.2f}%{row['average_gens']:>15.2f}")
+    print(f'Replayed {len(output_files)} files ({len(shards)} shards) in {time.time() - start:.2f}s')
+
+    if args.output_file is not None:
+        with open(args.output_file, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(report[0].keys()))
+            writer.writeheader()
+            writer.writerows(report)
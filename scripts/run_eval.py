@@ -1,12 +1,18 @@
 import copy
 import json
 import argparse
+import threading
 import tqdm
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
 
 from pal import interface, runtime
+from pal.core.executor import ProgramExecutor
+from adaptive_consistency import LRUCache
+from jsonl_reader import JsonlReader
 # from pal.prompt import math_prompts
 
 
@@ -31,6 +37,14 @@ parser.add_argument('--seed', default=1, type = int)
 parser.add_argument('--answer_type', default='float', type = str, help='Type of answer to expect. One of float or str')
 parser.add_argument('--stop_criteria', default=None, type = str, help='AdaptiveConsistency stop criteria to use. Defaults to Self-Consistency')
 parser.add_argument('--stop_criteria_thresh', default=0.95, type = float, help='AdaptiveConsistency stop criteria threshold to use. See AdaptiveConsistency for details')
+parser.add_argument('--futility', action='store_true', help='Also stop once the remaining budget can no longer meet the stop criteria')
+parser.add_argument('--step_size', default='1', type = str, help='Number of samples per request, or "auto" to request the minimum number of samples that could meet the stop criteria')
+parser.add_argument('--num_workers', default=0, type = int, help='Execute generated programs in parallel in this many worker processes. 0 runs them in-process')
+parser.add_argument('--num_concurrent', default=1, type = int, help='Number of questions to run concurrently, each with its own AdaptiveConsistency state. Output stays in dataset order')
+parser.add_argument('--max_inflight_requests', default=None, type = int, help='Global limit on concurrent backend requests. Defaults to --num_concurrent')
+parser.add_argument('--pipeline', action='store_true', help='Send the next generation request while the current batch of programs is executed and checked')
+parser.add_argument('--no_execution_cache', action='store_true', help='Re-execute generated programs that duplicate an earlier one up to whitespace and comments')
+parser.add_argument('--program_timeout', default=2, type = float, help='Wall-clock limit per generated program, in seconds, when using worker processes')
 
 
 args = parser.parse_args()
@@ -43,7 +57,8 @@ DATA_PATH = f'datasets/{args.dataset}.jsonl'
 if not os.path.exists(DATA_PATH):
     DATA_PATH = f'datasets/{args.dataset}.json'
 if DATA_PATH.endswith('.jsonl'):
-    examples = list(map(json.loads, open(DATA_PATH)))
+    # Records are read lazily, and slicing seeks straight to the first one
+    examples = JsonlReader(DATA_PATH, save_index=False)
 elif DATA_PATH.endswith('.json'):
     examples = json.load(open(DATA_PATH))['examples']
 
@@ -69,90 +84,138 @@ if args.prompt_type != 'code' and args.prompt_type != 'text':
     args.prompt_type = 'code'
 
 answer_type = args.answer_type
+step_size = args.step_size if args.step_size == 'auto' else int(args.step_size)
 # answer_type = 'str' if args.dataset.find('date')!=-1 else 'float'
-if args.prompt_type == 'code':
 
-    # PAL style prompting
-    if args.dataset.find('date')!=-1:
-        itf = interface.AdaptiveProgramInterface(
-            step_size = 1,
+if args.num_concurrent > 1 and args.prompt_type == 'code' and args.num_workers == 0:
+    # The in-process SIGALRM timeout only works on the main thread
+    args.num_workers = os.cpu_count()
+    print(f'Running programs in {args.num_workers} worker processes, since questions run concurrently')
+executor = ProgramExecutor(num_workers=args.num_workers, timeout=args.program_timeout) if args.prompt_type == 'code' and args.num_workers > 0 else None
+# Shared by the interfaces of all concurrent questions
+execution_cache = None if args.no_execution_cache else LRUCache()
+if args.num_concurrent > 1 or args.max_inflight_requests is not None:
+    interface.limit_backend_requests(args.max_inflight_requests or args.num_concurrent)
+
+
+def make_interface():
+    if args.prompt_type == 'code':
+
+        # PAL style prompting
+        if args.dataset.find('date')!=-1:
+            return interface.AdaptiveProgramInterface(
+                step_size = step_size,
+                max_gens=args.max_gens,
+                runtime = runtime.DateRuntime(snapshot=True),
+                stop=args.end,
+                model=args.model,
+                verbose=args.verbose,
+                openai_url=args.vicuna_url,
+                answer_type=answer_type,
+                stop_criteria = args.stop_criteria,
+                stop_criteria_thresh = args.stop_criteria_thresh,
+                futility = args.futility,
+                executor = executor,
+                execution_cache = execution_cache,
+                pipeline = args.pipeline,
+            )
+        else:
+            return interface.AdaptiveProgramInterface(
+                step_size = step_size,
+                max_gens=args.max_gens,
+                runtime = runtime.GenericRuntime(snapshot=True),
+                stop=args.end,
+                get_answer_expr='solution()',
+                model=args.model,
+                verbose=args.verbose,
+                openai_url=args.vicuna_url,
+                answer_type=answer_type,
+                stop_criteria = args.stop_criteria,
+                stop_criteria_thresh = args.stop_criteria_thresh,
+                futility = args.futility,
+                executor = executor,
+                execution_cache = execution_cache,
+                pipeline = args.pipeline,
+            )
+
+
+    elif args.prompt_type == 'text':
+        # CoT style prompting
+        return interface.AdaptiveTextInterface(
+            step_size = step_size,
             max_gens=args.max_gens,
-            runtime = runtime.DateRuntime(),
             stop=args.end,
             model=args.model,
-            verbose=args.verbose,
             openai_url=args.vicuna_url,
-            answer_type=answer_type,
-            stop_criteria = args.stop_criteria,
-            stop_criteria_thresh = args.stop_criteria_thresh,
-        )
-    else:
-        itf = interface.AdaptiveProgramInterface(
-            step_size = 1,
-            max_gens=args.max_gens,
-            stop=args.end,
-            get_answer_expr='solution()',
-            model=args.model,
-            verbose=args.verbose,
-            openai_url=args.vicuna_url,
-            answer_type=answer_type,
             stop_criteria = args.stop_criteria,
             stop_criteria_thresh = args.stop_criteria_thresh,
+            futility = args.futility,
         )
 
 
-elif args.prompt_type == 'text':
-    # CoT style prompting
-    itf = interface.AdaptiveTextInterface(
-        step_size = 1,
-        max_gens=args.max_gens,
-        stop=args.end,
-        model=args.model,
-        openai_url=args.vicuna_url,
-        stop_criteria = args.stop_criteria,
-        stop_criteria_thresh = args.stop_criteria_thresh,
-    )
-        
+# Each concurrent question runs on its own thread, with that thread's interface (and so its own AC state and history)
+local = threading.local()
+
+
+def solve(x):
+    if not hasattr(local, 'itf'):
+        local.itf = make_interface()
+    itf = local.itf
+    question = x['input']
+    result = copy.copy(x)
+    
+    try:
+        ans, answers = itf.run(math_prompts.MATH_PROMPT.format(question=question),
+            temperature=args.temperature, top_p=args.top_p,
+            max_tokens=args.max_tokens)
+        if answer_type == 'float':
+            ans = float(ans)
+            score = 1 if abs(ans - x['target']) < 1e-3 else 0
+        else:
+            score = 1 if ans == x['target'] else 0
+    except Exception as e:
+        print('Error',e)
+        ans = ''
+        # Failed to load any answers
+        answers = []
+        score = 0
+    
+    result['answer'] = ans
+    result['score'] = score
+    result['generation'] = itf.history
+    result['answers'] = answers
+    result['exhausted'] = itf.exhausted
+    itf.clear_history()
+    return result
 
 
 if args.append:
-    lines = open(OUTPUT_PATH).readlines()
-    num_skip_exps = len(lines)
-    scores = [x['score'] for x in map(json.loads, lines)]
+    # Streams the existing outputs, keeping only the scores
+    scores = [x['score'] for x in JsonlReader(OUTPUT_PATH, fields=['score'])]
+    num_skip_exps = len(scores)
 else:
     num_skip_exps = 0
     scores = []
 
 with open(OUTPUT_PATH, 'a' if args.append else 'w') as f:
-    pbar = tqdm.tqdm(examples[num_skip_exps:], initial=num_skip_exps, total=len(examples))
-    for x in pbar:
-        question = x['input']
-        result = copy.copy(x)
-        
-        try:
-            ans, answers = itf.run(math_prompts.MATH_PROMPT.format(question=question),
-                temperature=args.temperature, top_p=args.top_p,
-                max_tokens=args.max_tokens)
-            if answer_type == 'float':
-                ans = float(ans)
-                score = 1 if abs(ans - x['target']) < 1e-3 else 0
-            else:
-                score = 1 if ans == x['target'] else 0
-        except Exception as e:
-            print('Error',e)
-            ans = ''
-            # Failed to load any answers
-            answers = []
-            score = 0
-        scores.append(score)
-        
-        result['answer'] = ans
-        result['score'] = score
-        result['generation'] = itf.history
-        result['answers'] = answers
+    if args.num_concurrent <= 1:
+        results = map(solve, tqdm.tqdm(examples[num_skip_exps:], initial=num_skip_exps, total=len(examples)))
+    else:
+        # All questions are queued up front, so a question that stops early hands its thread to the next pending one.
+        # Results are written in dataset order, as soon as all earlier questions are done
+        pool = ThreadPoolExecutor(max_workers=args.num_concurrent)
+        pbar = tqdm.tqdm(initial=num_skip_exps, total=len(examples))
+        futures = deque(pool.submit(solve, x) for x in examples[num_skip_exps:])
+        for future in futures:
+            future.add_done_callback(lambda _: pbar.update())
+        # Drops each future once written, so that finished results are not all kept in memory
+        results = (futures.popleft().result() for _ in range(len(futures)))
+
+    for result in results:
+        scores.append(result['score'])
         f.write(json.dumps(result) + '\n')
-        
-        itf.clear_history()
         f.flush()
 
 print(f'Accuracy - {sum(scores) / len(scores)}')
+if execution_cache is not None:
+    print(f'Execution cache - {execution_cache.info()}')
@@ -0,0 +1,147 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from adaptive_consistency import stop_criteria_dict
+
+
+def sample_distributions(rng, num_questions, num_answers = 10, num_modes = 2, correct_mass = 0.6, concentration = 10., tail_mass = 0.1):
+    '''
+    Draws per-question answer distributions from a Dirichlet family. Answer 0 is the correct one.
+
+    The Dirichlet mean puts correct_mass on the correct answer, and splits the rest between num_modes - 1 distractor
+    answers and a tail of rarer answers, which gets tail_mass of it. Lower concentrations give more varied questions.
+
+    Returns:
+        np.ndarray: (num_questions, num_answers) answer probabilities.
+    '''
+    if not 0 < correct_mass < 1:
+        raise ValueError(f"correct_mass must be in (0, 1), got {correct_mass}")
+    if not 1 <= num_modes <= num_answers:
+        raise ValueError(f"num_modes must be between 1 and num_answers ({num_answers}), got {num_modes}")
+
+    mean = np.zeros(num_answers)
+    mean[0] = correct_mass
+    num_tail = num_answers - num_modes
+    if num_modes == 1 or num_tail == 0:
+        # All of the remaining mass goes to whichever group exists
+        share = 1 - correct_mass
+        mean[1:] = share / max(num_answers - 1, 1)
+    else:
+        mean[1:num_modes] = (1 - correct_mass) * (1 - tail_mass) / (num_modes - 1)
+        mean[num_modes:] = (1 - correct_mass) * tail_mass / num_tail
+    return rng.dirichlet(mean * concentration, size = num_questions)
+
+def sample_streams(rng, probs, max_gens = 40):
+    '''
+    Draws max_gens answers per question from its answer distribution.
+
+    Returns:
+        np.ndarray: (num_questions, max_gens) answer ids.
+    '''
+    cdf = np.cumsum(probs, axis = 1)
+    u = rng.uniform(size = (len(probs), max_gens)) * cdf[:, -1:]
+    return (u[..., None] >= cdf[:, None, :]).sum(axis = 2).clip(max = probs.shape[1] - 1)
+
+def simulate(criterion, answers, num_answers, min_gens = 1):
+    '''
+    Runs a stopping criteria over simulated sample streams, one generation step at a time for all questions that are
+    still sampling, with a single batched decision per step.
+
+    Args:
+        criterion (StoppingCriterias): The stopping criteria.
+        answers (np.ndarray): (num_questions, max_gens) answer ids, with answer 0 correct.
+        num_answers (int): Number of distinct answer ids.
+        min_gens (int): Minimum number of generations per question.
+
+    Returns:
+        Dict: Accuracy (in %), average generations, number of decisions and the CPU time spent deciding.
+    '''
+    num_questions, max_gens = answers.shape
+    rows = np.arange(num_questions)
+    counts = np.zeros((num_questions, num_answers), dtype = np.int64)
+    first_seen = np.full((num_questions, num_answers), max_gens, dtype = np.int64)
+    active = np.ones(num_questions, dtype = bool)
+    gens = np.full(num_questions, max_gens)
+    leader = np.zeros(num_questions, dtype = np.int64)
+    num_decisions, cpu_time = 0, 0.
+
+    for m in range(max_gens):
+        counts[rows, answers[:, m]] += 1
+        first_seen[rows, answers[:, m]] = np.minimum(first_seen[rows, answers[:, m]], m)
+        if m + 1 < min_gens:
+            continue
+
+        idx = np.flatnonzero(active)
+        if m == max_gens - 1:
+            stopped = idx
+        else:
+            sorted_counts = -np.sort(-counts[idx], axis = 1)
+            start = time.process_time()
+            stop = criterion.should_stop_counts_batch(sorted_counts)['stop']
+            cpu_time += time.process_time() - start
+            num_decisions += len(idx)
+            stopped = idx[np.asarray(stop, dtype = bool)]
+
+        # Majority answer, with ties broken by first occurrence as in Counter.most_common
+        leader[stopped] = np.argmax(counts[stopped] * (max_gens + 1) - first_seen[stopped], axis = 1)
+        gens[stopped] = m + 1
+        active[stopped] = False
+        if not active.any():
+            break
+
+    return {
+        'accuracy' : (leader == 0).mean() * 100,
+        'average_gens' : gens.mean(),
+        'average_gens_stderr' : gens.std(ddof = 1) / np.sqrt(num_questions) if num_questions > 1 else 0.,
+        'decisions' : num_decisions,
+        'decision_cpu_s' : cpu_time,
+        'decision_cpu_us' : cpu_time / max(num_decisions, 1) * 1e6,
+    }
+
+if __name__ == '__main__':
+
+    # Usage: python scripts/simulate_workload.py --stop_criteria beta majority --stop_criteria_thresh 0.8 0.95 --num_modes 3 --correct_mass 0.5
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stop_criteria', type=str, nargs='+', default=['beta'])
+    parser.add_argument('--stop_criteria_thresh', type=float, nargs='+', default=None, help='Thresholds to simulate for every criteria. Defaults to each criteria\'s own')
+    parser.add_argument('--num_questions', type=int, default=10000)
+    parser.add_argument('--max_gens', type=int, default=40)
+    parser.add_argument('--min_gens', type=int, default=1)
+    parser.add_argument('--num_answers', type=int, default=10, help='Number of distinct answers per question')
+    parser.add_argument('--num_modes', type=int, default=2, help='Number of likely answers (the correct one and num_modes - 1 distractors)')
+    parser.add_argument('--correct_mass', type=float, default=0.6, help='Mean probability of the correct answer')
+    parser.add_argument('--tail_mass', type=float, default=0.1, help='Share of the incorrect mass that goes to rare answers')
+    parser.add_argument('--concentration', type=float, default=10., help='Dirichlet concentration. Lower values give more varied questions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output_file', type=str, default=None, help='CSV file for the results')
+
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    probs = sample_distributions(rng, args.num_questions, args.num_answers, args.num_modes, args.correct_mass, args.concentration, args.tail_mass)
+    answers = sample_streams(rng, probs, args.max_gens)
+
+    rows = []
+    for name in args.stop_criteria:
+        for conf_thresh in (args.stop_criteria_thresh or [None]):
+            criterion = stop_criteria_dict[name]() if conf_thresh is None else stop_criteria_dict[name](conf_thresh = conf_thresh)
+            outp = simulate(criterion, answers, args.num_answers, args.min_gens)
+            rows.append({'stop_criteria' : name, 'stop_criteria_thresh' : getattr(criterion, 'conf_thresh', None), **outp})
+
+    # Self-Consistency over all max_gens samples, for reference
+    baseline = simulate(stop_criteria_dict['always_false'](), answers, args.num_answers)
+    print(f"Self-Consistency ({args.max_gens} gens): Accuracy {baseline['accuracy']:.2f}%")
+    print(f"{'Criteria':<14}{'Thresh':>10}{'Accuracy':>12}{'Average Gens':>15}{'Savings':>10}{'Decisions':>12}{'us/decision':>14}")
+    for row in rows:
+        thresh = '' if row['stop_criteria_thresh'] is None else f"{row['stop_criteria_thresh']:.4g}"
+        print(f"{row['stop_criteria']:<14}{thresh:>10}{row['accuracy']:>11.2f}%{row['average_gens']:>15.2f}{(1 - row['average_gens'] / args.max_gens) * 100:>9.1f}%{row['decisions']:>12}{row['decision_cpu_us']:>14.2f}")
+
+    if args.output_file is not None:
+        with open(args.output_file, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)